@@ -2,28 +2,40 @@
 
 import os
 import json
-import threading
-from datetime import datetime
 from pathlib import Path
 
-import requests
-import pyodbc
 from dotenv import load_dotenv
 
-from utils.redis_client import redis_client
+from utils import dispatcher, db
+from utils.http_client import get_session, WHATSAPP
 from app.constants import *
-from app.router import get_services_for_phone
+from app import session_store
+from app.repositories.profile_repo import get_employee_profile
+from app.repositories.expense_repo import (
+    fetch_expense_mapping,
+    resolve_expense_ids,
+)
 
 # ---------------- CLAIM IMPORTS ----------------
+from app.services import claim_reconcile
 from app.services.claim_adapter import (
-    login_with_phone,
-    upload_bill_attachments,
-    SessionExpiredError,
+    ClaimifyClient,
+    bill_payload,
+    claim_header,
+    match_new_bills,
 )
-from ocr.mistral_ocr import run_invoice_ocr
+from ocr.mistral_ocr import run_invoice_ocr_batch
 
 # ---------------- GRN IMPORTS ----------------
-from app.services.grn_adapter import extract_grn
+from app.services.grn_adapter import (
+    extract_grn,
+    submit_grn_job,
+)
+from app.services.media_adapter import (
+    download_media,
+    MediaTooLargeError,
+    MEDIA_MAX_BYTES,
+)
 
 
 
@@ -35,23 +47,6 @@ load_dotenv()
 WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
 PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
 BASE_URL = os.getenv("WHATSAPP_BASE_URL", "https://graph.facebook.com/v20.0")
-CLAIMIFY_API_BASE = os.getenv("CLAIMIFY_API_BASE")
-
-DRIVER = os.getenv("DRIVER")
-SQL_SERVER_HOST = os.getenv("SQL_SERVER_HOST")
-SQL_SERVER_PORT = os.getenv("SQL_SERVER_PORT", "1433")
-SQL_SERVER_USER = os.getenv("SQL_SERVER_USER")
-SQL_SERVER_PASSWORD = os.getenv("SQL_SERVER_PASSWORD")
-SQL_SERVER_DB = os.getenv("SQL_SERVER_DB")
-
-CONN_STR = (
-    f"DRIVER={DRIVER};"
-    f"SERVER={SQL_SERVER_HOST},{SQL_SERVER_PORT};"
-    f"DATABASE={SQL_SERVER_DB};"
-    f"UID={SQL_SERVER_USER};"
-    f"PWD={SQL_SERVER_PASSWORD};"
-    f"TrustServerCertificate=yes;"
-)
 
 # --------------------------------------------------
 # STORAGE
@@ -63,21 +58,15 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 TMP_DIR.mkdir(exist_ok=True)
 
 # --------------------------------------------------
-# REDIS HELPERS
+# HTTP (keep-alive sessions)
 # --------------------------------------------------
-def rkey(phone: str, key: str) -> str:
-    return f"wa:{phone}:{key}"
-
-def clear_session(phone: str):
-    for k in redis_client.scan_iter(f"wa:{phone}:*"):
-        redis_client.delete(k)
+whatsapp_http = get_session(WHATSAPP)
 
 # --------------------------------------------------
 # WHATSAPP SENDER
 # --------------------------------------------------
 def send_whatsapp_reply(to: str, text: str, reply_to: str):
-    
-    requests.post(
+    whatsapp_http.post(
         f"{BASE_URL}/{PHONE_NUMBER_ID}/messages",
         headers={
             "Authorization": f"Bearer {WHATSAPP_TOKEN}",
@@ -97,110 +86,14 @@ def send_whatsapp_reply(to: str, text: str, reply_to: str):
 # DB HELPERS (CLAIM)
 # --------------------------------------------------
 # --------------------------------------------------
-def fetch_expense_mapping(schema):
-    conn = pyodbc.connect(CONN_STR)
-    cur = conn.cursor()
-
-    cur.execute(
-        f"""
-        SELECT
-            et.expense_type_name,
-            est.expense_sub_type_name
-        FROM [{schema}].[ExpenseType] et
-        JOIN [{schema}].[ExpenseSubType] est
-            ON est.expense_type_id = et.expense_type_id
-        WHERE est.is_disabled = 0
-        ORDER BY et.expense_type_name, est.expense_sub_type_name
-        """
-    )
-
-    mapping = {}
-    for et_name, est_name in cur.fetchall():
-        mapping.setdefault(et_name, []).append(est_name)
-
-    cur.close()
-    conn.close()
-    return mapping
-# --------------------------------------------------
-def resolve_expense_ids(schema, expense_type, expense_sub_type):
-    conn = pyodbc.connect(CONN_STR)
-    cur = conn.cursor()
-
-    cur.execute(
-        f"""
-        SELECT
-            est.expense_type_id,
-            est.expense_sub_type_id
-        FROM [{schema}].[ExpenseSubType] est
-        JOIN [{schema}].[ExpenseType] et
-            ON et.expense_type_id = est.expense_type_id
-        WHERE
-            et.expense_type_name = ?
-            AND est.expense_sub_type_name = ?
-            AND est.is_disabled = 0
-        """,
-        expense_type,
-        expense_sub_type,
-    )
-
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    return (row.expense_type_id, row.expense_sub_type_id) if row else (None, None)
-# --------------------------------------------------
-def fetch_entities_for_employee(emp_no: int):
-    conn = pyodbc.connect(CONN_STR)
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        SELECT
-            eem.entity_id,
-            em.entity_name
-        FROM product.EmployeeEntityMapping eem
-        JOIN zeus_t1.EntityMaster em
-            ON em.entity_id = eem.entity_id
-        WHERE eem.emp_no = ?
-          AND eem.role_id = 4
-          AND (eem.is_disabled = 0 OR eem.is_disabled IS NULL)
-          AND em.deleted_on IS NULL
-        ORDER BY em.entity_name
-        """,
-        emp_no,
-    )
-
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-
-    return [
-        {"entity_id": r.entity_id, "entity_name": r.entity_name}
-        for r in rows
-    ]
-
-def fetch_employee_context(phone: str):
-    conn = pyodbc.connect(CONN_STR)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT emp_no, tenant_id
-        FROM [product].[EmployeeMaster]
-        WHERE (country_code + phone_number) = ?
-          AND (is_disabled IS NULL OR is_disabled = 0)
-        """,
-        phone,
-    )
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    return (int(row.emp_no), row.tenant_id) if row else (None, None)
-
 def get_latest_drafted_claim(schema, emp_no, entity_id):
-    conn = pyodbc.connect(CONN_STR)
-    cur = conn.cursor()
-    cur.execute(
+    """
+    (claim_no, total_claim_amount) of the newest draft, or (None, None).
+    A NULL total counts as 0.
+    """
+    row = db.fetch_one(
         f"""
-        SELECT TOP 1 claim_no
+        SELECT TOP 1 claim_no, total_claim_amount
         FROM [{schema}].[Claims]
         WHERE emp_id = ?
           AND entity_id = ?
@@ -210,119 +103,137 @@ def get_latest_drafted_claim(schema, emp_no, entity_id):
         """,
         emp_no,
         entity_id,
+        name="get_latest_drafted_claim",
     )
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    return int(row.claim_no) if row else None
+    if not row:
+        return None, None
+    return int(row.claim_no), float(row.total_claim_amount or 0)
 
 def resolve_expense_type_ids(schema):
-    conn = pyodbc.connect(CONN_STR)
-    cur = conn.cursor()
-    cur.execute(
+    row = db.fetch_one(
         f"""
         SELECT TOP 1 expense_type_id, expense_sub_type_id
         FROM [{schema}].[ExpenseSubType]
         ORDER BY expense_sub_type_id
-        """
+        """,
+        name="resolve_expense_type_ids",
     )
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
     return row.expense_type_id, row.expense_sub_type_id
 
-def normalize_date(date_str):
-    if not date_str:
-        return None
-    try:
-        if "/" in date_str:
-            return datetime.strptime(date_str, "%d/%m/%Y").strftime("%Y-%m-%d")
-        return datetime.strptime(date_str, "%Y-%m-%d").strftime("%Y-%m-%d")
-    except Exception:
-        return None
-
 # --------------------------------------------------
 # GRN ASYNC
 # --------------------------------------------------
+def _grn_message(result):
+    if result is None:
+        return "❌ Failed to process GRN."
+    if result.get("sharepoint_url") and result.get("database_status") == "Success":
+        return "✅ *GRN processed successfully*\n• Uploaded\n• Database updated"
+    return "⚠️ GRN received but could not be fully processed."
+
+@dispatcher.task
 def process_grn_async(phone, path, reply_to):
     try:
-        result = extract_grn(path)
-        if result.get("sharepoint_url") and result.get("database_status") == "Success":
-            send_whatsapp_reply(
-                phone,
-                "✅ *GRN processed successfully*\n• Uploaded\n• Database updated",
-                reply_to,
-            )
-        else:
-            send_whatsapp_reply(
-                phone,
-                "⚠️ GRN received but could not be fully processed.",
-                reply_to,
-            )
-    except Exception:
-        send_whatsapp_reply(
-            phone,
-            "❌ Failed to process GRN.",
-            reply_to,
-        )
+        # Job API: the shared poller calls queue_finish_grn later
+        if submit_grn_job(Path(path), phone, reply_to):
+            return
+        result = extract_grn(Path(path))
+    except Exception as e:
+        print("❌ GRN failed:", e)
+        result = None
+
+    finish_grn(phone, reply_to, result)
+
+@dispatcher.task
+def finish_grn(phone, reply_to, result):
+    try:
+        send_whatsapp_reply(phone, _grn_message(result), reply_to)
     finally:
-        clear_session(phone)
+        session_store.clear(phone)
+
+def queue_finish_grn(phone, reply_to, result):
+    # grn_adapter poller callback
+    dispatcher.dispatch(
+        dispatcher.STAGE_GRN,
+        "finish_grn",
+        phone, reply_to, result,
+    )
 
 # --------------------------------------------------
 # CLAIM OCR
 # --------------------------------------------------
+def _restart_invoice(phone, reply_to, error):
+    """
+    add_image() moved the session to PROCESSING_OCR, which ignores
+    text; on failure go back to the image count so the user can resend
+    this invoice (an active claim is kept).
+    """
+    session_store.update(
+        phone,
+        clear_images=True,
+        expected_images=None,
+        received_images=None,
+        extracted_bills=None,
+        state=STATE_WAITING_FOR_IMAGE_COUNT,
+    )
+    send_whatsapp_reply(
+        phone,
+        f"{error}\n\nPlease send this invoice again.\n"
+        "How many images does this invoice have?",
+        reply_to,
+    )
+
+@dispatcher.task
 def process_claim_async(phone, reply_to):
     try:
-        images = redis_client.lrange(rkey(phone, "images"), 0, -1)
-        emp_no = int(redis_client.get(rkey(phone, "emp_no")))
-        schema = redis_client.get(rkey(phone, "schema"))
-        entity_id = redis_client.get(rkey(phone, "entity_id"))
+        session = session_store.load(phone, images=True)
+        paths = [i["path"] for i in session["images"]]
+        emp_no = int(session["emp_no"])
+        schema = session.get("schema")
+        entity_id = session.get("entity_id")
 
-        # 🔹 FETCH DYNAMIC EXPENSE MAPPING (ONCE PER CLAIM)
+        # 🔹 FETCH DYNAMIC EXPENSE MAPPING (cached per tenant)
         expense_mapping = fetch_expense_mapping(schema)
 
-        # ---------- OCR ----------
-        extracted = []
-        for img in images:
-            result = run_invoice_ocr(
-                img,
-                expense_mapping=expense_mapping
-            )
-            extracted.append(result.get("structured") or {})
-
-        redis_client.setex(
-            rkey(phone, "extracted_bills"),
-            CHAT_TTL,
-            json.dumps(extracted),
+        # ---------- OCR (parallel, order kept) ----------
+        results = run_invoice_ocr_batch(
+            paths,
+            expense_mapping=expense_mapping,
+            sha256s=[i["sha256"] for i in session["images"]],
         )
 
+        # One bill per image; each bill carries the file it came from
+        extracted = [
+            {**(r.get("structured") or {}), "files": [path]}
+            for path, r in zip(paths, results)
+        ]
+
         # ---------- 🔥 IMPORTANT FIX ----------
         # If a claim is already active, DO NOT ask draft question again.
-        active_claim = redis_client.get(rkey(phone, "active_claim_no"))
+        active_claim = session.get("active_claim_no")
 
         if active_claim:
             # Reuse same claim and auto-commit
-            redis_client.setex(
-                rkey(phone, "draft_claim_no"),
-                CHAT_TTL,
-                int(active_claim),
+            session_store.update(
+                phone,
+                extracted_bills=json.dumps(extracted),
+                draft_claim_no=int(active_claim),
             )
 
-            threading.Thread(
-                target=commit_claim,
-                args=(phone, "1", reply_to),  # force "Add to existing"
-                daemon=True,
-            ).start()
+            dispatcher.dispatch(
+                dispatcher.STAGE_COMMIT,
+                "commit_claim",
+                phone, "1", reply_to,  # force "Add to existing"
+            )
             return
 
         # ---------- FIRST INVOICE ONLY ----------
-        draft = get_latest_drafted_claim(schema, emp_no, entity_id)
-        redis_client.setex(rkey(phone, "draft_claim_no"), CHAT_TTL, draft or "")
-
-        redis_client.setex(
-            rkey(phone, "state"),
-            CHAT_TTL,
-            STATE_WAITING_FOR_CLAIM_CHOICE,
+        draft, draft_total = get_latest_drafted_claim(schema, emp_no, entity_id)
+        session_store.update(
+            phone,
+            extracted_bills=json.dumps(extracted),
+            draft_claim_no=draft or "",
+            draft_total=draft_total,
+            state=STATE_WAITING_FOR_CLAIM_CHOICE,
         )
 
         # ✅ OPTION B UX FIX
@@ -343,42 +254,52 @@ def process_claim_async(phone, reply_to):
             )
 
     except Exception as e:
+        _restart_invoice(phone, reply_to, f"❌ OCR failed.\n{e}")
+
+# --------------------------------------------------
+# CLAIM COMMIT (FINAL STEP)
+# --------------------------------------------------
+def _claim_saved_anyway(phone, reply_to, claim_no, error):
+    try:
+        session_store.update(
+            phone,
+            active_claim_no=claim_no,
+            extracted_bills=None,
+            state=STATE_WAITING_FOR_ADD_MORE,
+        )
+    finally:
         send_whatsapp_reply(
             phone,
-            f"❌ OCR failed.\n{e}",
+            f"⚠️ Invoice saved to claim {claim_no}, but:\n{error}\n\n"
+            "Do you want to add another invoice?\n"
+            "1️⃣ Yes\n"
+            "2️⃣ Done",
             reply_to,
         )
 
-# --------------------------------------------------
-# CLAIM COMMIT (FINAL STEP)
-# --------------------------------------------------
+@dispatcher.task
 def commit_claim(phone, choice, reply_to):
+    session = {}
+    claim_no = None   # set once Claimify holds the bills
     try:
-        emp_no = int(redis_client.get(rkey(phone, "emp_no")))
-        schema = redis_client.get(rkey(phone, "schema"))
-        entity_id = redis_client.get(rkey(phone, "entity_id"))
+        session = session_store.load(phone)
+        emp_no = int(session["emp_no"])
+        schema = session.get("schema")
+        entity_id = session.get("entity_id")
 
-        bills = json.loads(redis_client.get(rkey(phone, "extracted_bills")))
-        images = redis_client.lrange(rkey(phone, "images"), 0, -1)
+        if not session.get("extracted_bills"):
+            return  # already committed (e.g. a repeated "1")
+        bills = json.loads(session["extracted_bills"])
 
-        draft_raw = redis_client.get(rkey(phone, "draft_claim_no"))
+        draft_raw = session.get("draft_claim_no")
         draft_claim_no = int(draft_raw) if draft_raw else None
 
-        # 🔐 Login
-        auth = login_with_phone(phone)
-        session_id = auth["session_id"]
-
         prepared_bills = []
         invoice_amount = 0.0  # amount for THIS upload only
 
         for bill in bills:
-            amount = float(bill.get("amount") or 0)
-            invoice_amount += amount
-
-            from_date = normalize_date(bill.get("from_date"))
-            to_date = normalize_date(bill.get("to_date")) or from_date
-
             # ✅ NEW: resolve expense IDs PER BILL from OCR output
+            # (dictionary lookup on the cached tenant taxonomy)
             expense_type = bill.get("expense_type")
             expense_sub_type = bill.get("expense_sub_type")
 
@@ -393,82 +314,87 @@ def commit_claim(phone, choice, reply_to):
                     f"Invalid expense mapping: {expense_type} → {expense_sub_type}"
                 )
 
-            prepared_bills.append({
-                "expense_type_id": et_id,
-                "expense_sub_type_id": est_id,
-                "from_date": from_date,
-                "to_date": to_date,
-                "bill_amount": amount,
-                "merchant_name": bill.get("merchant_name"),
-                "invoice_number": bill.get("invoice_number"),
-            })
-
-        payload = {
-            "claim": {
-                "claim_title": "WhatsApp Claim",
-                "claim_description": "Created via WhatsApp",
-                "emp_id": emp_no,
-                "entity_id": entity_id,
-                "total_claim_amount": invoice_amount,
-                "claim_status": "Drafted",
-            },
-            "bills": prepared_bills,
-        }
-
-        headers = {
-            "X-Session-Id": session_id,
-            "Content-Type": "application/json",
-        }
-
-        # 🔥 POST vs PUT
-        if choice == "1" and draft_claim_no:
-            resp = requests.put(
-                f"{CLAIMIFY_API_BASE}/api/claims/{draft_claim_no}",
-                json=payload,
-                headers=headers,
-                timeout=60,
-            )
+            prepared = bill_payload(bill, et_id, est_id)
+            invoice_amount += prepared["bill_amount"]
+            prepared_bills.append(prepared)
+
+        existing_claim_no = draft_claim_no if choice == "1" else None
+
+        # 🔹 Claim total before this upload: our running total for the
+        # active claim, else the total still waiting to be reconciled
+        # (the DB header is stale until then), else the DB header
+        previous_total = 0.0
+        if existing_claim_no:
+            pending_total = claim_reconcile.pending_total(phone, existing_claim_no)
+            if session.get("active_claim_no") == str(existing_claim_no) and session.get("claim_total"):
+                previous_total = float(session["claim_total"])
+            elif pending_total is not None:
+                previous_total = pending_total
+            else:
+                previous_total = float(session.get("draft_total") or 0)
+
+        # 🔥 Append to the existing claim (PUT fallback) or create a new one
+        claimify = ClaimifyClient(phone)
+        header = claim_header(emp_no, entity_id, previous_total + invoice_amount)
+
+        if existing_claim_no:
+            data, appended = claimify.add_bills(existing_claim_no, header, prepared_bills)
         else:
-            resp = requests.post(
-                f"{CLAIMIFY_API_BASE}/api/claims",
-                json=payload,
-                headers=headers,
-                timeout=60,
-            )
+            data, appended = claimify.create_claim(header, prepared_bills), False
 
-        if resp.status_code != 200:
-            raise Exception(resp.text)
+        claim_no = data.get("claim_no") or existing_claim_no
 
-        data = resp.json()
-        claim_no = data["claim_no"]
-
-        # 🔹 Authoritative total from backend
+        # 🔹 Authoritative total from backend, else a local running total
         total_claim_amount = (
             data.get("claim", {}).get("total_claim_amount")
             or data.get("total_claim_amount")
         )
+        if total_claim_amount is None:
+            total_claim_amount = previous_total + invoice_amount
 
-        # ✅ Attach invoice images
-        for bill in data["bills"]:
-            upload_bill_attachments(
-                session_id=session_id,
-                claim_no=claim_no,
-                bill_no=bill["bill_no"],
-                files=[Path(p) for p in images],
+        # 🔹 The bills are on the claim now: persist it before anything
+        # else can fail, so a retry never adds them a second time
+        session_store.update(
+            phone,
+            active_claim_no=claim_no,
+            claim_total=total_claim_amount,
+            needs_reconcile="1" if appended else session.get("needs_reconcile"),
+            extracted_bills=None,
+            state=STATE_WAITING_FOR_ADD_MORE,
+        )
+
+        # Appends leave the header stale: reconciled on "Done", or by the
+        # sweeper if the conversation is abandoned
+        if appended:
+            claim_reconcile.schedule(phone, claim_no, emp_no, entity_id, float(total_claim_amount))
+
+        # ✅ Attach each NEW bill's own files. The response may list
+        # every bill on the claim; nothing is attached blindly.
+        try:
+            new_bill_nos = match_new_bills(data["bills"], prepared_bills)
+            claimify.upload_bills(
+                claim_no,
+                {
+                    bill_no: [Path(p) for p in bill.get("files", [])]
+                    for bill_no, bill in zip(new_bill_nos, bills)
+                },
+            )
+            status_text = "✅ Invoice attached successfully"
+        except Exception as e:
+            print(f"❌ Attachments for claim {claim_no} failed:", e)
+            status_text = (
+                "⚠️ Invoice saved, but its files could not be attached.\n"
+                f"{e}"
             )
 
         # 🔹 Format amounts
         invoice_text = f"🧾 Invoice Amount: ₹ {invoice_amount:,.2f}"
-        total_text = (
-            f"\n💰 Total Claim Amount: ₹ {float(total_claim_amount):,.2f}"
-            if total_claim_amount is not None
-            else ""
-        )
+        total_text = f"\n💰 Total Claim Amount: ₹ {float(total_claim_amount):,.2f}"
 
         # 🔁 Ask user to add more invoices
         send_whatsapp_reply(
             phone,
-            f"✅ Invoice attached successfully\n"
+            f"{status_text}\n"
             f"📄 Claim No: {claim_no}\n"
             f"{invoice_text}"
             f"{total_text}\n\n"
@@ -478,21 +404,17 @@ def commit_claim(phone, choice, reply_to):
             reply_to,
         )
 
-        # 🔹 Persist active claim
-        redis_client.setex(
-            rkey(phone, "active_claim_no"),
-            CHAT_TTL,
-            claim_no,
-        )
+    except Exception as e:
+        if claim_no:
+            # Past the write: resending would add the bills twice
+            _claim_saved_anyway(phone, reply_to, claim_no, e)
+            return
 
-        # 🔹 Move to add-more decision state
-        redis_client.setex(
-            rkey(phone, "state"),
-            CHAT_TTL,
-            STATE_WAITING_FOR_ADD_MORE,
-        )
+        # Auto-commit after OCR (active claim): still in PROCESSING_OCR
+        if session.get("state") == STATE_PROCESSING_OCR:
+            _restart_invoice(phone, reply_to, f"❌ Failed to save claim\n{e}")
+            return
 
-    except Exception as e:
         send_whatsapp_reply(
             phone,
             f"❌ Failed to save claim\n{e}",
@@ -502,18 +424,93 @@ def commit_claim(phone, choice, reply_to):
 
 
 
+# --------------------------------------------------
+# CLAIM DONE (RECONCILE ONCE)
+# --------------------------------------------------
+@dispatcher.task
+def reconcile_claim(phone, claim_no, emp_no, entity_id, total):
+    """
+    Bills added through the append endpoint leave the claim header
+    untouched; one header-only PUT sets the final total.
+    """
+    ClaimifyClient(phone).update_claim(
+        int(claim_no),
+        claim_header(int(emp_no), entity_id, float(total)),
+        [],
+    )
+    claim_reconcile.done(phone, claim_no, float(total))
+
+def queue_reconcile_claim(phone, claim_no, emp_no, entity_id, total):
+    # claim_reconcile sweeper callback (abandoned conversations)
+    dispatcher.dispatch(
+        dispatcher.STAGE_COMMIT,
+        "reconcile_claim",
+        phone, claim_no, emp_no, entity_id, total,
+    )
+
+@dispatcher.task
+def finalize_claim(phone, reply_to):
+    try:
+        session = session_store.load(phone)
+        claim_no = session.get("active_claim_no")
+        total = session.get("claim_total")
+
+        if session.get("needs_reconcile") and claim_no:
+            if not total:
+                raise Exception(f"total of claim {claim_no} is unknown")
+            reconcile_claim(phone, claim_no, session["emp_no"], session.get("entity_id"), total)
+            claim_reconcile.cancel(phone, claim_no)
+
+        send_whatsapp_reply(phone, "✅ Claim completed. Thank you!", reply_to)
+
+    except Exception as e:
+        send_whatsapp_reply(
+            phone,
+            f"⚠️ Invoices are saved, but the claim total could not be updated.\n{e}",
+            reply_to,
+        )
+    finally:
+        session_store.clear(phone)
+
+# --------------------------------------------------
+# MEDIA
+# --------------------------------------------------
+def _download_or_reply(sender, media_id, msg_id):
+    """
+    Streams the media to TMP_DIR and returns download_media's result
+    (path, sha256, ...); on a size-cap hit the user is told and None is
+    returned.
+    """
+    try:
+        return download_media(media_id, TMP_DIR, sender)
+    except MediaTooLargeError:
+        send_whatsapp_reply(
+            sender,
+            f"❌ File too large. Maximum size is {MEDIA_MAX_BYTES // (1024 * 1024)} MB.",
+            msg_id,
+        )
+        return None
+
 # --------------------------------------------------
 # MAIN HANDLER
 # --------------------------------------------------
+def extract_message(data):
+    try:
+        return data["entry"][0]["changes"][0]["value"].get("messages", [None])[0]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+@dispatcher.task
 def handle_whatsapp_incoming(data):
-    msg = data["entry"][0]["changes"][0]["value"].get("messages", [None])[0]
+    msg = extract_message(data)
     if not msg:
         return
 
     sender = msg["from"]  # full WhatsApp number (e.g. 919119166247)
     msg_id = msg["id"]
     msg_type = msg["type"]
-    state = redis_client.get(rkey(sender, "state"))
+    session = session_store.load(sender)
+    state = session.get("state")
 
     # ---------------- TEXT ----------------
     if msg_type == "text":
@@ -521,41 +518,44 @@ def handle_whatsapp_incoming(data):
 
         # ---- START ----
         if text in ("hi", "start"):
-            clear_session(sender)
+            session_store.clear(sender)
 
-            emp_no, tenant = fetch_employee_context(sender)
-            if not emp_no:
+            # Employee, services and entities in one (cached) round trip
+            profile = get_employee_profile(sender)
+            if not profile:
                 send_whatsapp_reply(sender, "❌ User not found.", msg_id)
                 return
 
-            redis_client.setex(rkey(sender, "emp_no"), CHAT_TTL, emp_no)
-            redis_client.setex(rkey(sender, "schema"), CHAT_TTL, tenant)
+            emp_no = profile["emp_no"]
+            identity = {"emp_no": emp_no, "schema": profile["tenant"]}
 
-            services = get_services_for_phone(sender)
-            service_set = set(services)
+            service_set = set(profile["services"])
 
             if not service_set:
                 send_whatsapp_reply(sender, "❌ You are not enabled for any service.", msg_id)
                 return
 
             if service_set == {"GRN"}:
-                redis_client.setex(rkey(sender, "state"), CHAT_TTL, STATE_WAITING_FOR_GRN_UPLOAD)
+                session_store.update(sender, **identity, state=STATE_WAITING_FOR_GRN_UPLOAD)
                 send_whatsapp_reply(sender, "📎 Please send GRN image or PDF.", msg_id)
                 return
 
             if service_set == {"CLAIM"}:
-                entities = fetch_entities_for_employee(emp_no)
+                entities = profile["entities"]
                 if not entities:
                     send_whatsapp_reply(
                         sender,
                         "❌ You are not mapped to any entity. Please contact support.",
                         msg_id,
                     )
-                    clear_session(sender)
                     return
 
-                redis_client.setex(rkey(sender, "entities"), CHAT_TTL, json.dumps(entities))
-                redis_client.setex(rkey(sender, "state"), CHAT_TTL, STATE_WAITING_FOR_ENTITY)
+                session_store.update(
+                    sender,
+                    **identity,
+                    entities=json.dumps(entities),
+                    state=STATE_WAITING_FOR_ENTITY,
+                )
 
                 lines = ["Select entity:"]
                 for idx, e in enumerate(entities, start=1):
@@ -565,7 +565,7 @@ def handle_whatsapp_incoming(data):
                 return
 
             if service_set == {"CLAIM", "GRN"}:
-                redis_client.setex(rkey(sender, "state"), CHAT_TTL, STATE_WAITING_FOR_SERVICE)
+                session_store.update(sender, **identity, state=STATE_WAITING_FOR_SERVICE)
                 send_whatsapp_reply(
                     sender,
                     "Which service do you want?\n"
@@ -585,8 +585,8 @@ def handle_whatsapp_incoming(data):
         # ---- SERVICE SELECTION ----
         if state == STATE_WAITING_FOR_SERVICE:
             if text == "1":
-                emp_no = int(redis_client.get(rkey(sender, "emp_no")))
-                entities = fetch_entities_for_employee(emp_no)
+                profile = get_employee_profile(sender) or {}
+                entities = profile.get("entities")
 
                 if not entities:
                     send_whatsapp_reply(
@@ -594,11 +594,14 @@ def handle_whatsapp_incoming(data):
                         "❌ You are not mapped to any entity. Please contact support.",
                         msg_id,
                     )
-                    clear_session(sender)
+                    session_store.clear(sender)
                     return
 
-                redis_client.setex(rkey(sender, "entities"), CHAT_TTL, json.dumps(entities))
-                redis_client.setex(rkey(sender, "state"), CHAT_TTL, STATE_WAITING_FOR_ENTITY)
+                session_store.update(
+                    sender,
+                    entities=json.dumps(entities),
+                    state=STATE_WAITING_FOR_ENTITY,
+                )
 
                 lines = ["Select entity:"]
                 for idx, e in enumerate(entities, start=1):
@@ -608,16 +611,16 @@ def handle_whatsapp_incoming(data):
                 return
 
             if text == "2":
-                redis_client.setex(rkey(sender, "state"), CHAT_TTL, STATE_WAITING_FOR_GRN_UPLOAD)
+                session_store.update(sender, state=STATE_WAITING_FOR_GRN_UPLOAD)
                 send_whatsapp_reply(sender, "📎 Please send GRN image or PDF.", msg_id)
                 return
 
         # ---- ENTITY ----
         if state == STATE_WAITING_FOR_ENTITY:
-            entities_raw = redis_client.get(rkey(sender, "entities"))
+            entities_raw = session.get("entities")
             if not entities_raw:
                 send_whatsapp_reply(sender, "⚠️ Session expired. Please type Hi.", msg_id)
-                clear_session(sender)
+                session_store.clear(sender)
                 return
 
             entities = json.loads(entities_raw)
@@ -628,41 +631,46 @@ def handle_whatsapp_incoming(data):
                 send_whatsapp_reply(sender, "❌ Invalid selection. Please choose a valid number.", msg_id)
                 return
 
-            redis_client.setex(rkey(sender, "entity_id"), CHAT_TTL, entity_id)
-            redis_client.setex(rkey(sender, "state"), CHAT_TTL, STATE_WAITING_FOR_IMAGE_COUNT)
+            session_store.update(
+                sender,
+                entity_id=entity_id,
+                state=STATE_WAITING_FOR_IMAGE_COUNT,
+            )
 
             send_whatsapp_reply(sender, "How many images does this invoice have?", msg_id)
             return
 
         # ---- IMAGE COUNT ----
         if state == STATE_WAITING_FOR_IMAGE_COUNT:
-            redis_client.setex(rkey(sender, "expected_images"), CHAT_TTL, int(text))
-            redis_client.setex(rkey(sender, "received_images"), CHAT_TTL, 0)
-            redis_client.delete(rkey(sender, "images"))
-
-            redis_client.setex(rkey(sender, "state"), CHAT_TTL, STATE_WAITING_FOR_IMAGES)
+            session_store.update(
+                sender,
+                clear_images=True,
+                expected_images=int(text),
+                received_images=0,
+                state=STATE_WAITING_FOR_IMAGES,
+            )
             send_whatsapp_reply(sender, f"Please send {text} invoice image(s).", msg_id)
             return
 
         # ---- CLAIM CHOICE (✅ OPTION B FIX) ----
         if state == STATE_WAITING_FOR_CLAIM_CHOICE:
-            draft_raw = redis_client.get(rkey(sender, "draft_claim_no"))
+            draft_raw = session.get("draft_claim_no")
             has_draft = bool(draft_raw)
 
             if has_draft and text in ("1", "2"):
-                threading.Thread(
-                    target=commit_claim,
-                    args=(sender, text, msg_id),
-                    daemon=True,
-                ).start()
+                dispatcher.dispatch(
+                    dispatcher.STAGE_COMMIT,
+                    "commit_claim",
+                    sender, text, msg_id,
+                )
                 return
 
             if not has_draft and text == "1":
-                threading.Thread(
-                    target=commit_claim,
-                    args=(sender, "2", msg_id),  # force Create New
-                    daemon=True,
-                ).start()
+                dispatcher.dispatch(
+                    dispatcher.STAGE_COMMIT,
+                    "commit_claim",
+                    sender, "2", msg_id,  # force Create New
+                )
                 return
 
             send_whatsapp_reply(
@@ -675,48 +683,49 @@ def handle_whatsapp_incoming(data):
         # ---- ADD ANOTHER INVOICE ----
         if state == STATE_WAITING_FOR_ADD_MORE:
             if text in ("1", "yes"):
-                redis_client.delete(rkey(sender, "images"))
-                redis_client.delete(rkey(sender, "expected_images"))
-                redis_client.delete(rkey(sender, "received_images"))
-
-                redis_client.setex(rkey(sender, "state"), CHAT_TTL, STATE_WAITING_FOR_IMAGE_COUNT)
+                session_store.update(
+                    sender,
+                    clear_images=True,
+                    expected_images=None,
+                    received_images=None,
+                    state=STATE_WAITING_FOR_IMAGE_COUNT,
+                )
                 send_whatsapp_reply(sender, "How many images does this invoice have?", msg_id)
                 return
 
             if text in ("2", "done"):
-                send_whatsapp_reply(sender, "✅ Claim completed. Thank you!", msg_id)
-                clear_session(sender)
+                dispatcher.dispatch(
+                    dispatcher.STAGE_COMMIT,
+                    "finalize_claim",
+                    sender, msg_id,
+                )
                 return
 
     # ---------------- CLAIM MEDIA ----------------
     if msg_type in ("image", "document") and state == STATE_WAITING_FOR_IMAGES:
         media = msg.get("image") or msg.get("document")
-        media_id = media["id"]
-
-        meta = requests.get(
-            f"{BASE_URL}/{media_id}",
-            headers={"Authorization": f"Bearer {WHATSAPP_TOKEN}"},
-        ).json()
 
-        content = requests.get(
-            meta["url"],
-            headers={"Authorization": f"Bearer {WHATSAPP_TOKEN}"},
-        ).content
+        download = _download_or_reply(sender, media["id"], msg_id)
+        if not download:
+            return
 
-        path = TMP_DIR / f"{sender}_{datetime.utcnow().timestamp()}.jpg"
-        path.write_bytes(content)
+        status, received, expected = session_store.add_image(
+            sender, str(download["path"]), download["sha256"]
+        )
 
-        redis_client.rpush(rkey(sender, "images"), str(path))
-        received = redis_client.incr(rkey(sender, "received_images"))
-        expected = int(redis_client.get(rkey(sender, "expected_images")))
+        if status == session_store.IMAGE_REJECTED:
+            # Batch already handed to OCR by a concurrent upload
+            download["path"].unlink(missing_ok=True)
+            send_whatsapp_reply(sender, "⏳ Invoices are already being processed.", msg_id)
+            return
 
-        if received >= expected:
+        if status == session_store.IMAGE_BATCH_COMPLETE:
             send_whatsapp_reply(sender, "⏳ Processing invoices…", msg_id)
-            threading.Thread(
-                target=process_claim_async,
-                args=(sender, msg_id),
-                daemon=True,
-            ).start()
+            dispatcher.dispatch(
+                dispatcher.STAGE_OCR,
+                "process_claim_async",
+                sender, msg_id,
+            )
         else:
             send_whatsapp_reply(sender, f"📎 Invoice {received}/{expected} received", msg_id)
         return
@@ -724,28 +733,16 @@ def handle_whatsapp_incoming(data):
     # ---------------- GRN MEDIA ----------------
     if msg_type in ("image", "document") and state == STATE_WAITING_FOR_GRN_UPLOAD:
         media = msg.get("image") or msg.get("document")
-        media_id = media["id"]
-        mime = media.get("mime_type", "")
 
-        meta = requests.get(
-            f"{BASE_URL}/{media_id}",
-            headers={"Authorization": f"Bearer {WHATSAPP_TOKEN}"},
-        ).json()
-
-        content = requests.get(
-            meta["url"],
-            headers={"Authorization": f"Bearer {WHATSAPP_TOKEN}"},
-        ).content
-
-        ext = ".pdf" if mime == "application/pdf" else ".jpg"
-        path = TMP_DIR / f"{sender}_{datetime.utcnow().timestamp()}{ext}"
-        path.write_bytes(content)
+        download = _download_or_reply(sender, media["id"], msg_id)
+        if not download:
+            return
 
         send_whatsapp_reply(sender, "⏳ Processing GRN…", msg_id)
 
-        threading.Thread(
-            target=process_grn_async,
-            args=(sender, path, msg_id),
-            daemon=True,
-        ).start()
+        dispatcher.dispatch(
+            dispatcher.STAGE_GRN,
+            "process_grn_async",
+            sender, str(download["path"]), msg_id,
+        )
         return
@@ -1,16 +1,35 @@
 # app/main.py
 
 import os
-import threading
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import PlainTextResponse, JSONResponse
 from dotenv import load_dotenv
 
-from app.handler import handle_whatsapp_incoming
+from app.handler import (  # also registers dispatcher tasks
+    extract_message,
+    queue_finish_grn,
+    queue_reconcile_claim,
+)
+from app.services import grn_adapter, claim_reconcile
+from utils import dispatcher, metrics
+from utils.dedup import is_duplicate, forget
 
 load_dotenv()
 
-app = FastAPI(title="WhatsApp Microservice")
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    dispatcher.start()
+    grn_adapter.start_poller(queue_finish_grn)
+    claim_reconcile.start_sweeper(queue_reconcile_claim)
+    yield
+    claim_reconcile.stop_sweeper()
+    grn_adapter.stop_poller()
+    dispatcher.stop()
+
+
+app = FastAPI(title="WhatsApp Microservice", lifespan=lifespan)
 
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN", "my_verify_token")
 
@@ -39,13 +58,29 @@ async def receive_message(request: Request):
         data = await request.json()
         print("📩 Incoming webhook:", data)
 
-        # Run handler in background thread
-        thread = threading.Thread(
-            target=handle_whatsapp_incoming,
-            args=(data,),
-            daemon=True,
-        )
-        thread.start()
+        msg = extract_message(data)
+
+        # Drop Meta redeliveries before any work is queued
+        if msg and is_duplicate(msg["id"]):
+            print("🔁 Duplicate webhook dropped:", msg["id"])
+            return JSONResponse({"status": "duplicate"})
+
+        # Queue handler on the sender's lane (in-order per sender)
+        try:
+            dispatcher.dispatch(
+                dispatcher.STAGE_WEBHOOK,
+                "handle_whatsapp_incoming",
+                data,
+                key=msg["from"] if msg else "",
+                block=False,
+            )
+        except dispatcher.QueueFullError:
+            # Backpressure: Meta redelivers non-2xx webhooks later,
+            # so the redelivery must not be treated as a duplicate
+            if msg:
+                forget(msg["id"])
+            print("⚠️ Webhook queue full, asking Meta to retry")
+            return JSONResponse({"status": "busy"}, status_code=503)
 
         # Immediate ACK to Meta
         return JSONResponse({"status": "accepted"})
@@ -55,6 +90,14 @@ async def receive_message(request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# --------------------------------------------------
+# Metrics (dispatcher backpressure etc.)
+# --------------------------------------------------
+@app.get("/metrics")
+async def get_metrics():
+    return JSONResponse(metrics.snapshot())
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=50103, reload=True)
\ No newline at end of file
@@ -0,0 +1,76 @@
+import os
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from utils import db
+from utils.cache import TwoTierCache
+
+load_dotenv()
+
+EXPENSE_CACHE_TTL = int(os.getenv("EXPENSE_CACHE_TTL", "3600"))
+EXPENSE_CACHE_LOCAL_TTL = int(os.getenv("EXPENSE_CACHE_LOCAL_TTL", "60"))
+
+_taxonomy_cache = TwoTierCache(
+    "expense_taxonomy",
+    ttl=EXPENSE_CACHE_TTL,
+    local_ttl=EXPENSE_CACHE_LOCAL_TTL,
+)
+
+
+def _load_taxonomy(schema: str) -> Dict:
+    rows = db.fetch_all(
+        f"""
+        SELECT
+            et.expense_type_name,
+            est.expense_sub_type_name,
+            est.expense_type_id,
+            est.expense_sub_type_id
+        FROM [{schema}].[ExpenseType] et
+        JOIN [{schema}].[ExpenseSubType] est
+            ON est.expense_type_id = et.expense_type_id
+        WHERE est.is_disabled = 0
+        ORDER BY et.expense_type_name, est.expense_sub_type_name
+        """,
+        name="load_expense_taxonomy",
+    )
+
+    mapping = {}
+    ids = {}
+    for et_name, est_name, et_id, est_id in rows:
+        mapping.setdefault(et_name, []).append(est_name)
+        ids.setdefault(et_name, {})[est_name] = [et_id, est_id]
+
+    return {"mapping": mapping, "ids": ids}
+
+
+def get_expense_taxonomy(schema: str) -> Dict:
+    """
+    Returns the tenant's expense taxonomy:
+      {
+        "mapping": {type_name: [sub_type_name, ...]},
+        "ids": {type_name: {sub_type_name: [type_id, sub_type_id]}}
+      }
+    Cached per schema (in-process + Redis).
+    """
+    return _taxonomy_cache.get(schema, lambda: _load_taxonomy(schema))
+
+
+def invalidate_expense_taxonomy(schema: str):
+    """
+    Call after ExpenseType / ExpenseSubType changes for a tenant.
+    """
+    _taxonomy_cache.invalidate(schema)
+
+
+def fetch_expense_mapping(schema: str) -> Dict:
+    return get_expense_taxonomy(schema)["mapping"]
+
+
+def resolve_expense_ids(
+    schema: str,
+    expense_type: Optional[str],
+    expense_sub_type: Optional[str],
+) -> Tuple[Optional[int], Optional[int]]:
+    ids = get_expense_taxonomy(schema)["ids"].get(expense_type, {}).get(expense_sub_type)
+    return (ids[0], ids[1]) if ids else (None, None)
@@ -0,0 +1,120 @@
+import os
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from utils import db
+from utils.cache import TwoTierCache
+
+load_dotenv()
+
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "600"))
+PROFILE_CACHE_LOCAL_TTL = int(os.getenv("PROFILE_CACHE_LOCAL_TTL", "60"))
+
+_profile_cache = TwoTierCache(
+    "employee_profile",
+    ttl=PROFILE_CACHE_TTL,
+    local_ttl=PROFILE_CACHE_LOCAL_TTL,
+    max_entries=4096,
+)
+
+# Uses the persisted full_phone column (see sql/employee_full_phone.sql)
+# so the phone lookup can seek an index instead of scanning. Until that
+# migration is applied the original (unindexed) expression is used.
+_INDEXED_FILTER = """
+    full_phone = ?
+    AND (is_disabled IS NULL OR is_disabled = 0)
+"""
+_FALLBACK_FILTER = """
+    (country_code + phone_number) = ?
+    AND (is_disabled IS NULL OR is_disabled = 0)
+"""
+
+_employee_filter: Optional[str] = None
+
+
+def _get_employee_filter() -> str:
+    global _employee_filter
+    if _employee_filter is None:
+        row = db.fetch_one(
+            "SELECT COL_LENGTH('product.EmployeeMaster', 'full_phone') AS len",
+            name="check_full_phone_column",
+        )
+        if row and row.len:
+            _employee_filter = _INDEXED_FILTER
+        else:
+            print("⚠️ product.EmployeeMaster.full_phone missing; "
+                  "apply sql/employee_full_phone.sql. Using unindexed phone lookup.")
+            _employee_filter = _FALLBACK_FILTER
+    return _employee_filter
+
+
+def _load_profile(phone: str) -> Optional[Dict]:
+    employee_filter = _get_employee_filter()
+
+    with db.cursor("load_employee_profile") as cur:
+        cur.execute(
+            f"""
+            SET NOCOUNT ON;
+
+            SELECT TOP 1 emp_no, tenant_id
+            FROM [product].[EmployeeMaster]
+            WHERE {employee_filter};
+
+            SELECT feature
+            FROM [product].[WhatsappUser]
+            WHERE phone_number = ?
+              AND is_disabled = 0;
+
+            SELECT
+                eem.entity_id,
+                em.entity_name
+            FROM product.EmployeeEntityMapping eem
+            JOIN zeus_t1.EntityMaster em
+                ON em.entity_id = eem.entity_id
+            WHERE eem.emp_no = (
+                    SELECT TOP 1 emp_no
+                    FROM [product].[EmployeeMaster]
+                    WHERE {employee_filter}
+                )
+              AND eem.role_id = 4
+              AND (eem.is_disabled = 0 OR eem.is_disabled IS NULL)
+              AND em.deleted_on IS NULL
+            ORDER BY em.entity_name;
+            """,
+            phone,
+            phone,
+            phone,
+        )
+
+        employee = cur.fetchone()
+        cur.nextset()
+        features = cur.fetchall()
+        cur.nextset()
+        entities = cur.fetchall()
+
+    if not employee:
+        return None
+
+    return {
+        "emp_no": int(employee.emp_no),
+        "tenant": employee.tenant_id,
+        "services": [r.feature.strip().upper() for r in features],
+        "entities": [
+            {"entity_id": r.entity_id, "entity_name": r.entity_name}
+            for r in entities
+        ],
+    }
+
+
+def get_employee_profile(phone: str) -> Optional[Dict]:
+    """
+    Returns employee number, tenant, enabled services and entities for
+    a phone in one DB round trip, cached per phone.
+    Returns None if the employee is not found (not cached).
+    """
+    return _profile_cache.get(phone, lambda: _load_profile(phone))
+
+
+def invalidate_employee_profile(phone: str):
+    _profile_cache.invalidate(phone)
@@ -1,182 +1,275 @@
 # app/services/claim_adapter.py
 
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
-from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
 
-import requests
+from utils import metrics
+from utils.http_client import get_session, CLAIMIFY
+from utils.multipart import MultipartStream
+from app.services.claimify_session import call_with_session, SessionExpiredError  # noqa: F401
 
 # --------------------------------------------------
 # CONFIG
 # --------------------------------------------------
 CLAIMIFY_API_BASE = os.getenv("CLAIMIFY_API_BASE")
-REQUEST_TIMEOUT = 15
+CLAIM_TIMEOUT = 60
+UPLOAD_TIMEOUT = 15
+BILL_BATCH_SIZE = int(os.getenv("CLAIMIFY_BILL_BATCH_SIZE", "20"))
+UPLOAD_PARALLELISM = int(os.getenv("CLAIMIFY_UPLOAD_PARALLELISM", "4"))
 
 if not CLAIMIFY_API_BASE:
     raise RuntimeError("❌ CLAIMIFY_API_BASE not set in environment")
 
-# --------------------------------------------------
-# DEFAULTS (IMPORTANT)
-# --------------------------------------------------
-DEFAULT_EXPENSE_TYPE_ID = 1        # ✅ SAME as Claimify UI default
-DEFAULT_EXPENSE_SUB_TYPE_ID = 1    # ✅ SAFE default
-
-# --------------------------------------------------
-# INTERNAL EXCEPTION
-# --------------------------------------------------
-class SessionExpiredError(Exception):
-    pass
+_upload_pool = ThreadPoolExecutor(
+    max_workers=UPLOAD_PARALLELISM,
+    thread_name_prefix="claimify-upload",
+)
 
 
 # --------------------------------------------------
-# AUTH
+# PAYLOADS
 # --------------------------------------------------
-def login_with_phone(phone: str) -> Dict:
-    resp = requests.post(
-        f"{CLAIMIFY_API_BASE}/api/login",
-        params={"phone": phone},
-        json={"email": "", "password": ""},
-        timeout=REQUEST_TIMEOUT,
-    )
-
-    resp.raise_for_status()
-    data = resp.json()
+def normalize_date(date_str: Optional[str]) -> Optional[str]:
+    if not date_str:
+        return None
+    try:
+        if "/" in date_str:
+            return datetime.strptime(date_str, "%d/%m/%Y").strftime("%Y-%m-%d")
+        return datetime.strptime(date_str, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except Exception:
+        return None
 
-    if "sessionId" not in data:
-        raise RuntimeError("Login failed: sessionId missing")
 
+def claim_header(emp_no: int, entity_id: str, total_claim_amount: float) -> Dict:
     return {
-        "session_id": data["sessionId"],
-        "user": data.get("user"),
+        "claim_title": "WhatsApp Claim",
+        "claim_description": "Created via WhatsApp",
+        "emp_id": emp_no,
+        "entity_id": entity_id,
+        "total_claim_amount": total_claim_amount,
+        "claim_status": "Drafted",
     }
 
 
-# --------------------------------------------------
-# PAYLOAD NORMALIZER (CRITICAL)
-# --------------------------------------------------
-def normalize_bill_payload(raw: Dict) -> Dict:
+def bill_payload(extracted: Dict, expense_type_id: int, expense_sub_type_id: int) -> Dict:
     """
-    Converts OCR output → Claimify-safe Bill payload
+    Converts one OCR extraction (amount / from_date / to_date ...) into
+    a Claimify bill.
     """
-
-    today = date.today().isoformat()
+    from_date = normalize_date(extracted.get("from_date"))
 
     return {
-        "expense_type_id": DEFAULT_EXPENSE_TYPE_ID,
-        "expense_sub_type_id": DEFAULT_EXPENSE_SUB_TYPE_ID,
-
-        "from_date": raw.get("invoice_date") or today,
-        "to_date": raw.get("invoice_date") or today,
-
-        "bill_amount": float(raw.get("total_amount") or 0),
-
-        # Optional but safe
-        "vat_amount": float(raw.get("vat_amount") or 0),
-        "merchant_name": raw.get("merchant_name"),
-        "invoice_number": raw.get("invoice_number"),
+        "expense_type_id": expense_type_id,
+        "expense_sub_type_id": expense_sub_type_id,
+        "from_date": from_date,
+        "to_date": normalize_date(extracted.get("to_date")) or from_date,
+        "bill_amount": float(extracted.get("amount") or 0),
+        "merchant_name": extracted.get("merchant_name"),
+        "invoice_number": extracted.get("invoice_number"),
     }
 
 
-# --------------------------------------------------
-# CLAIM CREATE / UPDATE
-# --------------------------------------------------
-def create_or_update_claim(
-    *,
-    session_id: str,
-    mode: str,              # "new" | "existing"
-    emp_id: int,
-    entity_id: str,
-    bill_payload: Dict,
-    existing_claim_no: Optional[int] = None,
-) -> Dict:
-
-    bill = normalize_bill_payload(bill_payload)
-
-    payload = {
-        "claim": {
-            "claim_title": "WhatsApp Claim",
-            "claim_description": "Created via WhatsApp OCR",
-            "emp_id": emp_id,
-            "entity_id": entity_id,
-            "total_claim_amount": bill["bill_amount"],
-            "claim_status": "Drafted",
-        },
-        "bills": [bill],
-    }
+def match_new_bills(response_bills: List[Dict], sent: List[Dict]) -> List[int]:
+    """
+    bill_no of each bill in `sent`, in order, from a save response that
+    may also list the claim's older bills. Matched on the echoed
+    invoice_number when every sent bill has a distinct one; otherwise
+    the newest len(sent) bill_nos are taken. Raises when the response
+    cannot account for every sent bill; call it after the save, with
+    the claim already recorded, and skip the attachments on error.
+    """
+    if not sent:
+        return []
+
+    numbers = [str(b.get("invoice_number") or "").strip() for b in sent]
+
+    if all(numbers) and len(set(numbers)) == len(numbers):
+        by_number = {}
+        for bill in sorted(response_bills, key=lambda b: b["bill_no"]):
+            number = str(bill.get("invoice_number") or "").strip()
+            if number:
+                by_number[number] = bill["bill_no"]   # newest wins over older duplicates
+        if all(n in by_number for n in numbers):
+            return [by_number[n] for n in numbers]
+
+    bill_nos = sorted(b["bill_no"] for b in response_bills)[-len(sent):]
+    if len(bill_nos) != len(sent):
+        raise Exception(
+            f"Claimify returned {len(bill_nos)} bill(s) for {len(sent)} sent; files not attached"
+        )
+    return bill_nos
 
-    headers = {
-        "X-Session-Id": session_id,
-        "Content-Type": "application/json",
-    }
 
-    # UPDATE
-    if mode == "existing" and existing_claim_no:
-        resp = requests.put(
-            f"{CLAIMIFY_API_BASE}/api/claims/{existing_claim_no}",
-            json=payload,
-            headers=headers,
-            timeout=REQUEST_TIMEOUT,
-        )
-    else:
-        resp = requests.post(
-            f"{CLAIMIFY_API_BASE}/api/claims",
-            json=payload,
-            headers=headers,
-            timeout=REQUEST_TIMEOUT,
-        )
+def _batches(bills: List[Dict]) -> List[List[Dict]]:
+    return [bills[i:i + BILL_BATCH_SIZE] for i in range(0, len(bills), BILL_BATCH_SIZE)] or [[]]
 
-    if resp.status_code == 401:
-        raise SessionExpiredError("Claimify session expired")
 
-    resp.raise_for_status()
-    data = resp.json()
+def _merge(responses: List[Dict]) -> Dict:
+    """
+    Folds the responses of a batched save into one: claim_no from the
+    first, claim totals from the last, bills de-duplicated by bill_no.
+    """
+    merged = dict(responses[-1])
+    merged["claim_no"] = responses[0].get("claim_no") or merged.get("claim_no")
 
-    return {
-        "claim_no": data["claim_no"],
-        "bill_nos": [b["bill_no"] for b in data.get("bills", [])],
-    }
+    bills = {}
+    for data in responses:
+        for bill in data.get("bills", []):
+            bills[bill["bill_no"]] = bill
+    merged["bills"] = list(bills.values())
+    return merged
 
 
 # --------------------------------------------------
-# ATTACH BILL FILES
+# CLIENT
 # --------------------------------------------------
-def upload_bill_attachments(
-    *,
-    session_id: str,
-    claim_no: int,
-    bill_no: int,
-    files: List[Path],
-) -> Dict:
-
-    multipart_files = []
-    open_files = []
+class ClaimifyClient:
+    """
+    Every Claimify call for one WhatsApp user. Requests share the pooled
+    CLAIMIFY session (PUTs retried on 429 / 5xx, POSTs only on 429 or
+    503 with Retry-After) and the cached login (a 401 refreshes it once
+    and retries).
+    """
 
-    try:
-        for f in files:
-            fh = f.open("rb")
-            open_files.append(fh)
-            multipart_files.append(
-                ("files", (f.name, fh, "application/octet-stream"))
+    def __init__(self, phone: str):
+        self.phone = phone
+        self.http = get_session(CLAIMIFY)
+
+    # ---------------- TRANSPORT ----------------
+    def _send(self, op: str, fn: Callable[[str], Optional[Dict]]) -> Optional[Dict]:
+        started = time.monotonic()
+        try:
+            return call_with_session(self.phone, fn)
+        finally:
+            metrics.observe(f"claimify.{op}", time.monotonic() - started)
+
+    def _json_call(
+        self,
+        op: str,
+        method: str,
+        path: str,
+        body: Dict,
+        ok: Tuple[int, ...] = (200,),
+        missing_ok: bool = False,
+    ) -> Optional[Dict]:
+        def send(session_id: str):
+            resp = self.http.request(
+                method,
+                f"{CLAIMIFY_API_BASE}{path}",
+                json=body,
+                headers={"X-Session-Id": session_id, "Content-Type": "application/json"},
+                timeout=CLAIM_TIMEOUT,
             )
 
-        resp = requests.post(
-            f"{CLAIMIFY_API_BASE}/api/upload/server",
-            params={"sessionId": session_id},
-            data={
-                "claim_no": claim_no,
-                "bill_no": bill_no,
-            },
-            files=multipart_files,
-            timeout=REQUEST_TIMEOUT,
-        )
-
-        if resp.status_code == 401:
-            raise SessionExpiredError("Claimify session expired")
-
-        resp.raise_for_status()
-        return resp.json()
-
-    finally:
-        for fh in open_files:
-            fh.close()
+            if resp.status_code == 401:
+                raise SessionExpiredError("Claimify session expired")
+            if missing_ok and resp.status_code in (404, 405):
+                return None
+            if resp.status_code not in ok:
+                raise Exception(resp.text)
+
+            return resp.json()
+
+        return self._send(op, send)
+
+    # ---------------- CLAIMS ----------------
+    def create_claim(self, header: Dict, bills: List[Dict]) -> Dict:
+        """
+        POST /api/claims with the first BILL_BATCH_SIZE bills; any rest
+        is added to the new claim batch by batch.
+        """
+        first, *rest = _batches(bills)
+        created = self._json_call("create_claim", "POST", "/api/claims", {"claim": header, "bills": first})
+
+        if not rest:
+            return created
+
+        more, _ = self.add_bills(created["claim_no"], header, [b for batch in rest for b in batch])
+        return _merge([created, more])
+
+    def update_claim(self, claim_no: int, header: Dict, bills: List[Dict]) -> Dict:
+        """
+        PUT /api/claims/{claim_no}: header plus bills to add (Claimify
+        merges them); bills=[] only updates the header.
+        """
+        return _merge([
+            self._json_call(
+                "update_claim", "PUT", f"/api/claims/{claim_no}", {"claim": header, "bills": batch}
+            )
+            for batch in _batches(bills)
+        ])
+
+    def append_bills(self, claim_no: int, bills: List[Dict]) -> Optional[Dict]:
+        """
+        POST /api/claims/{claim_no}/bills: only the new bills, no header.
+        Returns None when this Claimify has no append endpoint.
+        """
+        responses = []
+        for batch in _batches(bills):
+            data = self._json_call(
+                "append_bills", "POST", f"/api/claims/{claim_no}/bills",
+                {"bills": batch}, ok=(200, 201), missing_ok=True,
+            )
+            if data is None:
+                if responses:
+                    raise Exception("Claimify append endpoint disappeared mid-claim")
+                return None
+            responses.append(data)
+
+        merged = _merge(responses)
+        merged.setdefault("claim_no", claim_no)
+        return merged
+
+    def add_bills(self, claim_no: int, header: Dict, bills: List[Dict]) -> Tuple[Dict, bool]:
+        """
+        Adds bills to an existing claim. Returns (response, appended);
+        appended=False means the full PUT fallback was used.
+        """
+        data = self.append_bills(claim_no, bills)
+        if data is not None:
+            return data, True
+
+        metrics.incr("claimify.append_fallbacks")
+        return self.update_claim(claim_no, header, bills), False
+
+    # ---------------- ATTACHMENTS ----------------
+    def upload_files(self, claim_no: int, bill_no: int, files: List[Path]) -> Dict:
+        def send(session_id: str):
+            # Streamed from disk, not built in memory; rebuilt per attempt
+            body = MultipartStream(
+                {"claim_no": claim_no, "bill_no": bill_no},
+                [("files", f, "application/octet-stream") for f in files],
+            )
+            try:
+                resp = self.http.post(
+                    f"{CLAIMIFY_API_BASE}/api/upload/server",
+                    params={"sessionId": session_id},
+                    data=body,
+                    headers={"Content-Type": body.content_type},
+                    timeout=UPLOAD_TIMEOUT,
+                )
+            finally:
+                body.close()
+
+            if resp.status_code == 401:
+                raise SessionExpiredError("Claimify session expired")
+
+            resp.raise_for_status()
+            return resp.json()
+
+        return self._send("upload_files", send)
+
+    def upload_bills(self, claim_no: int, files_by_bill: Dict[int, List[Path]]) -> List[Dict]:
+        """
+        Uploads each bill's own files, UPLOAD_PARALLELISM at a time.
+        """
+        futures = [
+            _upload_pool.submit(self.upload_files, claim_no, bill_no, files)
+            for bill_no, files in files_by_bill.items()
+            if files
+        ]
+        return [f.result() for f in futures]
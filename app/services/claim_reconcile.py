@@ -0,0 +1,142 @@
+# app/services/claim_reconcile.py
+
+import os
+import json
+import time
+import threading
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+
+from utils import metrics
+from utils.redis_client import redis_client
+from app.constants import CHAT_TTL
+
+load_dotenv()
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+CLAIM_RECONCILE_INTERVAL = float(os.getenv("CLAIM_RECONCILE_INTERVAL", "60"))
+
+# Claims whose header still has to be brought up to date after appends.
+# Shared by every process:
+#   claims:reconcile      HASH  "{phone}:{claim_no}" -> [phone, claim_no, emp_no, entity_id, total]
+#   claims:reconcile:due  ZSET  same member, scored by when to reconcile
+# A record outlives the conversation and is only dropped once the header
+# holds its total, so later conversations seed their total from it.
+DATA_KEY = "claims:reconcile"
+DUE_KEY = "claims:reconcile:due"
+
+
+def _member(phone: str, claim_no) -> str:
+    return f"{phone}:{claim_no}"
+
+
+# --------------------------------------------------
+# SCHEDULE
+# --------------------------------------------------
+def schedule(phone: str, claim_no: int, emp_no: int, entity_id: str, total: float):
+    """
+    Records the claim's running total. If the user never answers "Done"
+    the header is reconciled once the conversation has expired
+    (CHAT_TTL after the last append).
+    """
+    member = _member(phone, claim_no)
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hset(DATA_KEY, member, json.dumps([phone, claim_no, emp_no, entity_id, total]))
+    pipe.zadd(DUE_KEY, {member: time.time() + CHAT_TTL})
+    pipe.execute()
+
+
+def pending_total(phone: str, claim_no) -> Optional[float]:
+    """
+    The claim's running total while its header is not reconciled yet.
+    It outlives the conversation, so a new one seeds from it instead of
+    the stale DB header.
+    """
+    raw = redis_client.hget(DATA_KEY, _member(phone, claim_no))
+    return float(json.loads(raw)[4]) if raw else None
+
+
+def done(phone: str, claim_no, total: float):
+    """
+    Drops the record once the header holds `total`, unless an append has
+    rescheduled it meanwhile with a newer total.
+    """
+    member = _member(phone, claim_no)
+
+    def drop(pipe):
+        raw = pipe.hget(DATA_KEY, member)
+        if not raw or pipe.zscore(DUE_KEY, member) is not None:
+            return
+        if float(json.loads(raw)[4]) != float(total):
+            return
+        pipe.multi()
+        pipe.hdel(DATA_KEY, member)
+
+    redis_client.transaction(drop, DATA_KEY, DUE_KEY)
+
+
+def cancel(phone: str, claim_no):
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.zrem(DUE_KEY, _member(phone, claim_no))
+    pipe.hdel(DATA_KEY, _member(phone, claim_no))
+    pipe.execute()
+
+
+# --------------------------------------------------
+# SHARED SWEEPER
+# --------------------------------------------------
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def sweep_once(on_due: Callable[..., None]):
+    for member in redis_client.zrangebyscore(DUE_KEY, 0, time.time()):
+        # ZREM is the hand-over: only one process gets 1 back. The data
+        # stays until reconcile_claim calls done(), so pending_total()
+        # still sees it while the header is stale.
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.zrem(DUE_KEY, member)
+        pipe.hget(DATA_KEY, member)
+        removed, raw = pipe.execute()
+
+        if removed and raw:
+            metrics.incr("claimify.reconcile.expired")
+            on_due(*json.loads(raw))
+
+
+def _sweep_loop(on_due: Callable[..., None]):
+    while not _stop.wait(CLAIM_RECONCILE_INTERVAL):
+        try:
+            sweep_once(on_due)
+        except Exception as e:
+            print("⚠️ Claim reconcile sweeper error:", e)
+
+
+def start_sweeper(on_due: Callable[..., None]):
+    """
+    on_due(phone, claim_no, emp_no, entity_id, total) is called once per
+    claim that is due; it should queue the header update, not run it.
+    """
+    global _thread
+    if _thread is not None:
+        return
+
+    _stop.clear()
+    _thread = threading.Thread(
+        target=_sweep_loop, args=(on_due,), name="claim-reconcile", daemon=True
+    )
+    _thread.start()
+
+
+def stop_sweeper(timeout: float = 5):
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=timeout)
+        _thread = None
+
+
+metrics.register_gauge("claimify.reconcile.pending", lambda: redis_client.zcard(DUE_KEY))
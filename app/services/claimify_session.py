@@ -0,0 +1,141 @@
+# app/services/claimify_session.py
+
+import os
+import time
+import zlib
+import threading
+from typing import Callable, Dict, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+from utils import metrics
+from utils.http_client import get_session, CLAIMIFY
+from utils.redis_client import redis_client
+
+load_dotenv()
+
+T = TypeVar("T")
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+CLAIMIFY_API_BASE = os.getenv("CLAIMIFY_API_BASE")
+LOGIN_TIMEOUT = 15
+
+# Used when the login response carries no expiry
+CLAIMIFY_SESSION_TTL = int(os.getenv("CLAIMIFY_SESSION_TTL", "3000"))
+# Cached sessions are dropped this long before Claimify expires them
+CLAIMIFY_SESSION_MARGIN = int(os.getenv("CLAIMIFY_SESSION_MARGIN", "60"))
+
+LOGIN_LOCK_TTL = 15        # seconds; covers one login round trip
+LOGIN_WAIT_TIMEOUT = 10.0  # how long other workers wait for that login
+
+# Striped so concurrent commits for one phone share a lock without
+# keeping a lock per phone forever
+_stripes = [threading.Lock() for _ in range(64)]
+
+
+def _skey(phone: str) -> str:
+    return f"claimify:session:{phone}"
+
+
+def _lock_key(phone: str) -> str:
+    return f"claimify:session:{phone}:lock"
+
+
+def _local_lock(phone: str) -> threading.Lock:
+    return _stripes[zlib.crc32(phone.encode()) % len(_stripes)]
+
+
+class SessionExpiredError(Exception):
+    pass
+
+
+# --------------------------------------------------
+# AUTH
+# --------------------------------------------------
+def login_with_phone(phone: str) -> Dict:
+    resp = get_session(CLAIMIFY).post(
+        f"{CLAIMIFY_API_BASE}/api/login",
+        params={"phone": phone},
+        json={"email": "", "password": ""},
+        timeout=LOGIN_TIMEOUT,
+    )
+
+    resp.raise_for_status()
+    data = resp.json()
+
+    if "sessionId" not in data:
+        raise RuntimeError("Login failed: sessionId missing")
+
+    return {
+        "session_id": data["sessionId"],
+        "user": data.get("user"),
+        "expires_in": data.get("expiresIn"),   # seconds, when Claimify sends it
+    }
+
+
+# --------------------------------------------------
+# LOGIN (SINGLE-FLIGHT)
+# --------------------------------------------------
+def _login(phone: str) -> str:
+    auth = login_with_phone(phone)
+    ttl = int(auth.get("expires_in") or CLAIMIFY_SESSION_TTL) - CLAIMIFY_SESSION_MARGIN
+
+    if ttl > 0:
+        redis_client.setex(_skey(phone), ttl, auth["session_id"])
+
+    metrics.incr("claimify.logins")
+    return auth["session_id"]
+
+
+def _refresh(phone: str, stale: Optional[str] = None) -> str:
+    """
+    Logs in once for all threads / workers that saw `stale` (or no
+    session): the first one takes the Redis lock and logs in, the rest
+    wait for the new session to appear.
+    """
+    with _local_lock(phone):
+        current = redis_client.get(_skey(phone))
+        if current and current != stale:
+            return current
+
+        owner = redis_client.set(_lock_key(phone), "1", nx=True, ex=LOGIN_LOCK_TTL)
+        if not owner:
+            deadline = time.monotonic() + LOGIN_WAIT_TIMEOUT
+            while time.monotonic() < deadline:
+                time.sleep(0.1)
+                current = redis_client.get(_skey(phone))
+                if current and current != stale:
+                    return current
+            # The other login is stuck; do our own
+
+        try:
+            return _login(phone)
+        finally:
+            if owner:
+                redis_client.delete(_lock_key(phone))
+
+
+# --------------------------------------------------
+# PUBLIC
+# --------------------------------------------------
+def get_session_id(phone: str) -> str:
+    session_id = redis_client.get(_skey(phone))
+    if session_id:
+        metrics.incr("claimify.session_hits")
+        return session_id
+    return _refresh(phone)
+
+
+def call_with_session(phone: str, fn: Callable[[str], T]) -> T:
+    """
+    Runs fn(session_id) with the cached Claimify session. On
+    SessionExpiredError the session is refreshed once and fn retried.
+    """
+    session_id = get_session_id(phone)
+    try:
+        return fn(session_id)
+    except SessionExpiredError:
+        metrics.incr("claimify.session_expired")
+        return fn(_refresh(phone, stale=session_id))
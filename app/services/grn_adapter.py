@@ -1,13 +1,55 @@
 # app/services/grn_adapter.py
 
-import requests
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, Optional
 
-GRN_API_URL = "http://161.97.142.50:50102/extract/grn"
+from dotenv import load_dotenv
 
+from utils import metrics
+from utils.http_client import get_session, GRN
+from utils.redis_client import redis_client
+
+load_dotenv()
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+GRN_API_BASE = os.getenv("GRN_API_BASE", "http://161.97.142.50:50102").rstrip("/")
+GRN_API_URL = os.getenv("GRN_API_URL", f"{GRN_API_BASE}/extract/grn")
+GRN_JOBS_URL = os.getenv("GRN_JOBS_URL", f"{GRN_API_BASE}/extract/grn/jobs")
+
+# 0 = always use the blocking extraction, never the jobs endpoint
+GRN_JOBS_ENABLED = os.getenv("GRN_JOBS_ENABLED", "1") == "1"
+# How long a 404/405 from the jobs endpoint is trusted before probing again
+GRN_JOBS_PROBE_TTL = int(os.getenv("GRN_JOBS_PROBE_TTL", "3600"))
+
+GRN_POLL_INTERVAL = float(os.getenv("GRN_POLL_INTERVAL", "5"))
+GRN_JOB_TIMEOUT = int(os.getenv("GRN_JOB_TIMEOUT", "1800"))   # seconds
+GRN_POLL_PARALLELISM = int(os.getenv("GRN_POLL_PARALLELISM", "8"))
+# Outlives a slow cycle; the leader renews it every cycle
+GRN_POLL_LOCK_TTL = int(os.getenv("GRN_POLL_LOCK_TTL", "60"))
+
+# Pending jobs, shared by every process: job_id -> {phone, reply_to, submitted_at}
+JOBS_KEY = "grn:jobs"
+POLL_LOCK_KEY = "grn:poller:lock"
+UNSUPPORTED_KEY = "grn:jobs:unsupported"
+
+DONE_STATUSES = ("done", "completed", "success")
+FAILED_STATUSES = ("failed", "error")
+
+
+# --------------------------------------------------
+# BLOCKING EXTRACTION (FALLBACK)
+# --------------------------------------------------
 def extract_grn(file_path: Path) -> dict:
     with file_path.open("rb") as f:
-        resp = requests.post(
+        resp = get_session(GRN).post(
             GRN_API_URL,
             files={"file": (file_path.name, f)},
             timeout=(10, 900),  # ✅ 10s connect, 15 min read
@@ -15,3 +57,192 @@ def extract_grn(file_path: Path) -> dict:
 
     resp.raise_for_status()
     return resp.json()
+
+
+# --------------------------------------------------
+# JOB SUBMISSION
+# --------------------------------------------------
+def _job_id(resp) -> Optional[str]:
+    """
+    None when the GRN service has no jobs endpoint (caller falls back
+    to the blocking extraction).
+    """
+    if resp.status_code in (404, 405):
+        metrics.incr("grn.jobs.unsupported")
+        # Shared, so no process pays for another full upload to learn it
+        redis_client.setex(UNSUPPORTED_KEY, GRN_JOBS_PROBE_TTL, "1")
+        return None
+
+    resp.raise_for_status()
+    data = resp.json()
+    return str(data.get("job_id") or data["id"])
+
+
+def _job_record(phone: str, reply_to: str) -> str:
+    return json.dumps({"phone": phone, "reply_to": reply_to, "submitted_at": time.time()})
+
+
+def submit_grn_job(file_path: Path, phone: str, reply_to: str) -> Optional[str]:
+    """
+    Uploads the GRN and registers the job for the shared poller, which
+    hands the result to its on_complete callback. Returns the job id,
+    or None if jobs are disabled or not supported.
+    """
+    if not GRN_JOBS_ENABLED or redis_client.exists(UNSUPPORTED_KEY):
+        return None
+
+    with file_path.open("rb") as f:
+        resp = get_session(GRN).post(
+            GRN_JOBS_URL,
+            files={"file": (file_path.name, f)},
+            timeout=(10, 120),   # upload only; no waiting for the extraction
+        )
+
+    job_id = _job_id(resp)
+    if job_id:
+        redis_client.hset(JOBS_KEY, job_id, _job_record(phone, reply_to))
+        metrics.incr("grn.jobs.submitted")
+    return job_id
+
+
+# --------------------------------------------------
+# SHARED POLLER
+# --------------------------------------------------
+# (phone, reply_to, result); result is None when the job failed
+CompletionHandler = Callable[[str, str, Optional[dict]], None]
+
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+_poll_pool = ThreadPoolExecutor(
+    max_workers=GRN_POLL_PARALLELISM,
+    thread_name_prefix="grn-poll",
+)
+
+# Every process runs the thread, but only the lock holder polls
+_token = uuid.uuid4().hex
+
+_CLAIM_POLLER = redis_client.register_script("""
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+""")
+
+_RELEASE_POLLER = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def _is_leader() -> bool:
+    return bool(_CLAIM_POLLER(keys=[POLL_LOCK_KEY], args=[_token, GRN_POLL_LOCK_TTL]))
+
+
+def _poll_job(job_id: str) -> Optional[tuple]:
+    """
+    Returns (result,) when the job is finished (result None on failure)
+    or None while it is still running.
+    """
+    resp = get_session(GRN).get(f"{GRN_JOBS_URL}/{job_id}", timeout=(5, 15))
+    if resp.status_code == 404:
+        return (None,)   # the service lost the job
+
+    resp.raise_for_status()
+    data = resp.json()
+    status = str(data.get("status", "")).lower()
+
+    if status in DONE_STATUSES:
+        return (data.get("result") or data,)
+    if status in FAILED_STATUSES:
+        return (None,)
+    return None
+
+
+def _finish(job_id: str, job: dict, result: Optional[dict], on_complete: CompletionHandler):
+    # HDEL is the hand-over: only one process gets 1 back, even if a
+    # lock hand-over briefly leaves two pollers running
+    if not redis_client.hdel(JOBS_KEY, job_id):
+        return
+
+    metrics.incr("grn.jobs.completed" if result else "grn.jobs.failed")
+    metrics.observe("grn.job", time.time() - job["submitted_at"])
+    on_complete(job["phone"], job["reply_to"], result)
+
+
+def _check_job(job_id: str, raw: str, on_complete: CompletionHandler):
+    job = json.loads(raw)
+
+    try:
+        outcome = _poll_job(job_id)
+    except Exception as e:
+        print(f"⚠️ GRN job {job_id} poll failed:", e)
+        outcome = None
+
+    if outcome is None and time.time() - job["submitted_at"] > GRN_JOB_TIMEOUT:
+        outcome = (None,)
+
+    if outcome is not None:
+        _finish(job_id, job, outcome[0], on_complete)
+
+
+def poll_once(on_complete: CompletionHandler):
+    """
+    Checks every pending job, GRN_POLL_PARALLELISM at a time.
+    """
+    futures = [
+        _poll_pool.submit(_check_job, job_id, raw, on_complete)
+        for job_id, raw in redis_client.hgetall(JOBS_KEY).items()
+    ]
+    for f in futures:
+        try:
+            f.result()
+        except Exception as e:
+            print("⚠️ GRN job check failed:", e)
+
+
+def _poll_loop(on_complete: CompletionHandler):
+    while not _stop.wait(GRN_POLL_INTERVAL):
+        try:
+            if _is_leader():
+                poll_once(on_complete)
+        except Exception as e:
+            print("⚠️ GRN poller error:", e)
+
+
+def start_poller(on_complete: CompletionHandler):
+    """
+    on_complete(phone, reply_to, result) is called once per finished
+    job; it should queue the follow-up work, not run it.
+    """
+    global _thread
+    if _thread is not None:
+        return
+
+    _stop.clear()
+    _thread = threading.Thread(
+        target=_poll_loop, args=(on_complete,), name="grn-poller", daemon=True
+    )
+    _thread.start()
+
+
+def stop_poller(timeout: float = 5):
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=timeout)
+        _thread = None
+
+    # Let another process take over without waiting for the TTL
+    try:
+        _RELEASE_POLLER(keys=[POLL_LOCK_KEY], args=[_token])
+    except Exception as e:
+        print("⚠️ GRN poller lock not released:", e)
+
+
+metrics.register_gauge("grn.jobs.pending", lambda: redis_client.hlen(JOBS_KEY))
@@ -0,0 +1,110 @@
+# app/services/media_adapter.py
+
+import os
+import time
+import hashlib
+import mimetypes
+from datetime import datetime
+from pathlib import Path
+from typing import Dict
+
+from dotenv import load_dotenv
+
+from utils import metrics
+from utils.http_client import get_session, WHATSAPP
+
+load_dotenv()
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
+BASE_URL = os.getenv("WHATSAPP_BASE_URL", "https://graph.facebook.com/v20.0")
+
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(25 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+# mimetypes picks odd extensions for some of these (e.g. .jpe)
+MIME_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/heic": ".heic",
+    "application/pdf": ".pdf",
+}
+
+
+class MediaTooLargeError(Exception):
+    pass
+
+
+def extension_for(mime: str) -> str:
+    return MIME_EXTENSIONS.get(mime) or mimetypes.guess_extension(mime) or ".bin"
+
+
+# --------------------------------------------------
+# DOWNLOAD
+# --------------------------------------------------
+def download_media(media_id: str, dest_dir: Path, prefix: str) -> Dict:
+    """
+    Streams a WhatsApp media object to disk.
+    Returns:
+    {
+        path: Path,
+        sha256: str,     # hex digest of the file bytes
+        size: int,
+        mime_type: str
+    }
+    """
+    http = get_session(WHATSAPP)
+    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
+
+    meta_res = http.get(f"{BASE_URL}/{media_id}", headers=headers, timeout=10)
+    meta_res.raise_for_status()
+    meta = meta_res.json()
+
+    if int(meta.get("file_size") or 0) > MEDIA_MAX_BYTES:
+        raise MediaTooLargeError(f"{meta['file_size']} bytes")
+
+    mime = (meta.get("mime_type") or "").split(";")[0].strip().lower()
+    path = dest_dir / f"{prefix}_{datetime.utcnow().timestamp()}{extension_for(mime)}"
+    part = path.with_name(path.name + ".part")
+
+    digest = hashlib.sha256()
+    size = 0
+    started = time.monotonic()
+
+    try:
+        with http.get(meta["url"], headers=headers, stream=True) as resp:
+            resp.raise_for_status()
+            with part.open("wb") as fh:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > MEDIA_MAX_BYTES:
+                        raise MediaTooLargeError(f"> {MEDIA_MAX_BYTES} bytes")
+                    digest.update(chunk)
+                    fh.write(chunk)
+        part.replace(path)
+    except Exception:
+        part.unlink(missing_ok=True)
+        raise
+
+    elapsed = time.monotonic() - started
+    metrics.observe("media.download", elapsed)
+    metrics.incr("media.download_bytes", size)
+    print(f"📥 Media {media_id}: {size} bytes in {elapsed:.2f}s ({mime})")
+
+    return {
+        "path": path,
+        "sha256": digest.hexdigest(),
+        "size": size,
+        "mime_type": mime,
+    }
+
+
+def _throughput() -> float:
+    seconds = metrics.get_timing("media.download")["total"]
+    return metrics.get_counter("media.download_bytes") / seconds if seconds else 0.0
+
+
+metrics.register_gauge("media.download_bytes_per_sec", _throughput)
@@ -0,0 +1,119 @@
+# app/session_store.py
+
+import json
+from typing import Dict
+
+from utils.redis_client import redis_client
+from app.constants import CHAT_TTL, STATE_WAITING_FOR_IMAGES, STATE_PROCESSING_OCR
+
+# --------------------------------------------------
+# LAYOUT
+# --------------------------------------------------
+# One conversation = two keys:
+#   wa:{phone}         HASH  state, emp_no, schema, entities, entity_id,
+#                            expected_images, received_images,
+#                            extracted_bills, draft_claim_no, draft_total,
+#                            active_claim_no, claim_total, needs_reconcile
+#   wa:{phone}:images  LIST  downloaded invoices as JSON {path, sha256},
+#                            in arrival order
+# Both share one TTL, refreshed on every transition.
+
+
+def session_key(phone: str) -> str:
+    return f"wa:{phone}"
+
+
+def images_key(phone: str) -> str:
+    return f"wa:{phone}:images"
+
+
+# --------------------------------------------------
+# READ
+# --------------------------------------------------
+def load(phone: str, images: bool = False) -> Dict:
+    """
+    Returns all session fields (strings) in one round trip; with
+    images=True the downloaded invoices ({path, sha256}) are included
+    under "images".
+    """
+    if not images:
+        return redis_client.hgetall(session_key(phone))
+
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(session_key(phone))
+    pipe.lrange(images_key(phone), 0, -1)
+    session, entries = pipe.execute()
+    session["images"] = [json.loads(e) for e in entries]
+    return session
+
+
+# --------------------------------------------------
+# WRITE
+# --------------------------------------------------
+def update(phone: str, clear_images: bool = False, **fields):
+    """
+    Applies one state transition atomically (MULTI/EXEC): fields set to
+    None are removed, the rest are written, optionally the image list is
+    dropped, and the TTL of both keys is refreshed once.
+    """
+    skey = session_key(phone)
+    ikey = images_key(phone)
+
+    to_set = {k: v for k, v in fields.items() if v is not None}
+    to_delete = [k for k, v in fields.items() if v is None]
+
+    pipe = redis_client.pipeline(transaction=True)
+    if to_set:
+        pipe.hset(skey, mapping=to_set)
+    if to_delete:
+        pipe.hdel(skey, *to_delete)
+    if clear_images:
+        pipe.unlink(ikey)
+    pipe.expire(skey, CHAT_TTL)
+    pipe.expire(ikey, CHAT_TTL)
+    pipe.execute()
+
+
+# --------------------------------------------------
+# IMAGE COLLECTOR
+# --------------------------------------------------
+# add_image() results
+IMAGE_REJECTED = -1   # not collecting (batch already handed over / no session)
+IMAGE_COLLECTING = 0
+IMAGE_BATCH_COMPLETE = 1   # exactly one caller per batch gets this
+
+# Append, count and hand over in one script: the state flip to
+# PROCESSING_OCR makes the "received >= expected" branch fire once,
+# however many uploads race for the last slot.
+_ADD_IMAGE = redis_client.register_script("""
+if redis.call('HGET', KEYS[1], 'state') ~= ARGV[3] then
+    return {-1, 0, 0}
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+local received = redis.call('HINCRBY', KEYS[1], 'received_images', 1)
+local expected = tonumber(redis.call('HGET', KEYS[1], 'expected_images') or '0')
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if received >= expected then
+    redis.call('HSET', KEYS[1], 'state', ARGV[4])
+    return {1, received, expected}
+end
+return {0, received, expected}
+""")
+
+
+def add_image(phone: str, path: str, sha256: str):
+    """
+    Appends an invoice with the hash computed while downloading it, so
+    OCR does not read the file again to key its cache. Returns (status, received, expected) where
+    status is one of IMAGE_REJECTED / IMAGE_COLLECTING / IMAGE_BATCH_COMPLETE.
+    """
+    status, received, expected = _ADD_IMAGE(
+        keys=[session_key(phone), images_key(phone)],
+        args=[json.dumps({"path": path, "sha256": sha256}), CHAT_TTL, STATE_WAITING_FOR_IMAGES, STATE_PROCESSING_OCR],
+    )
+    return int(status), int(received), int(expected)
+
+
+def clear(phone: str):
+    redis_client.unlink(session_key(phone), images_key(phone))
@@ -0,0 +1,139 @@
+# ocr/cache.py
+
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from utils import metrics
+
+load_dotenv()
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+BASE_DIR = Path(__file__).resolve().parents[1]
+OCR_CACHE_DIR = Path(os.getenv("OCR_CACHE_DIR", str(BASE_DIR / "uploads" / "_ocr_cache")))
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+RAW_DIR = OCR_CACHE_DIR / "raw"
+STRUCTURED_DIR = OCR_CACHE_DIR / "structured"
+RAW_DIR.mkdir(parents=True, exist_ok=True)
+STRUCTURED_DIR.mkdir(parents=True, exist_ok=True)
+
+_lock = threading.Lock()
+_total_bytes: Optional[int] = None  # lazily computed from disk
+
+
+# --------------------------------------------------
+# KEYS
+# --------------------------------------------------
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def mapping_fingerprint(expense_mapping: dict, version: str = "") -> str:
+    """
+    Structured extraction depends on the tenant mapping (and on the
+    prompt/model version), so it is part of the structured cache key.
+    """
+    blob = json.dumps(expense_mapping, sort_keys=True, separators=(",", ":")) + version
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
+
+
+# --------------------------------------------------
+# RAW OCR TEXT
+# --------------------------------------------------
+def get_raw(sha: str) -> Optional[str]:
+    data = _read(RAW_DIR / f"{sha}.json")
+    metrics.incr("ocr_cache.raw.hits" if data else "ocr_cache.raw.misses")
+    return data["raw_text"] if data else None
+
+
+def put_raw(sha: str, raw_text: str):
+    if raw_text.strip():
+        _write(RAW_DIR / f"{sha}.json", {"raw_text": raw_text})
+
+
+# --------------------------------------------------
+# STRUCTURED EXTRACTION
+# --------------------------------------------------
+def get_structured(sha: str, fingerprint: str) -> Optional[dict]:
+    data = _read(STRUCTURED_DIR / f"{sha}_{fingerprint}.json")
+    metrics.incr("ocr_cache.structured.hits" if data else "ocr_cache.structured.misses")
+    return data
+
+
+def put_structured(sha: str, fingerprint: str, structured: dict):
+    if structured:
+        _write(STRUCTURED_DIR / f"{sha}_{fingerprint}.json", structured)
+
+
+# --------------------------------------------------
+# STORAGE + EVICTION
+# --------------------------------------------------
+def _read(path: Path) -> Optional[dict]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+    path.touch()  # mtime doubles as last-access time for eviction
+    return data
+
+
+def _write(path: Path, data: dict):
+    global _total_bytes
+
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    tmp.replace(path)
+
+    with _lock:
+        if _total_bytes is None:
+            _total_bytes = sum(p.stat().st_size for p in _entries())
+        else:
+            _total_bytes += path.stat().st_size
+
+        if _total_bytes > OCR_CACHE_MAX_BYTES:
+            _evict()
+
+
+def _entries():
+    return list(RAW_DIR.glob("*.json")) + list(STRUCTURED_DIR.glob("*.json"))
+
+
+def _evict():
+    """
+    Drops least recently used entries until the cache is at 90% of its
+    size budget. Caller holds _lock.
+    """
+    global _total_bytes
+
+    files = []
+    for p in _entries():
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        files.append((st.st_mtime, st.st_size, p))
+    files.sort()
+
+    total = sum(size for _, size, _ in files)
+    target = OCR_CACHE_MAX_BYTES * 0.9
+
+    for _, size, p in files:
+        if total <= target:
+            break
+        p.unlink(missing_ok=True)
+        total -= size
+        metrics.incr("ocr_cache.evictions")
+
+    _total_bytes = total
@@ -1,12 +1,23 @@
 import os
-import requests
+import time
+import base64
 import tempfile
 import json
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
 from dotenv import load_dotenv
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 
-from prompt.ocr_prompt import get_ocr_prompt
+from utils import metrics
+from utils.http_client import get_session, MISTRAL
+from utils.rate_limit import RateLimiter
+from ocr import cache as ocr_cache
+from ocr.preprocess import preprocess_image
+from ocr.schema import validate_extraction, is_valid_extraction
+from ocr.rules import extract_with_rules
+from prompt.ocr_prompt import get_ocr_prompt, get_batch_ocr_prompt, get_repair_prompt, mapping_version
   # ✅ ADD PROMPT
 
 load_dotenv()
@@ -19,38 +30,122 @@ OCR_UPLOAD_URL = "https://api.mistral.ai/v1/files"
 OCR_PROCESS_URL = "https://api.mistral.ai/v1/ocr"
 CHAT_COMPLETIONS_URL = "https://api.mistral.ai/v1/chat/completions"
 
+# Bump when the prompt or extraction model changes, so cached
+# structured results from the old version are not reused.
+EXTRACTION_VERSION = "mistral-large-latest:v3"
+
+# document: upload the PDF as-is (one OCR call for all pages)
+# raster:   render each page and OCR it as an image
+PDF_OCR_MODE = os.getenv("PDF_OCR_MODE", "document")
+PDF_RASTER_DPI = int(os.getenv("PDF_RASTER_DPI", "300"))
+
+# Files up to this size are sent inline as a base64 data URL in the OCR
+# request instead of upload + OCR (0 disables inline mode).
+OCR_INLINE_MAX_BYTES = int(os.getenv("OCR_INLINE_MAX_BYTES", str(1024 * 1024)))
+
+# Max invoices per structured-extraction chat call
+EXTRACTION_BATCH_SIZE = max(1, int(os.getenv("EXTRACTION_BATCH_SIZE", "5")))
+
+mistral_http = get_session(MISTRAL)
+
+# ---------- CONCURRENCY ----------
+# Pages of one PDF and files of one claim are OCR'd in parallel on
+# separate pools (a file task waits on its page tasks, so sharing one
+# pool could deadlock). All Mistral calls share one rate limiter.
+OCR_PARALLELISM = int(os.getenv("OCR_PARALLELISM", "4"))
+MISTRAL_RPS = float(os.getenv("MISTRAL_RPS", "5"))
+MISTRAL_BURST = int(os.getenv("MISTRAL_BURST", "5"))
+
+mistral_limiter = RateLimiter("mistral", MISTRAL_RPS, MISTRAL_BURST)
+_page_pool = ThreadPoolExecutor(max_workers=OCR_PARALLELISM, thread_name_prefix="ocr-page")
+_file_pool = ThreadPoolExecutor(max_workers=OCR_PARALLELISM, thread_name_prefix="ocr-file")
+_cleanup_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr-cleanup")
+
 
 # ============================================================
-# INTERNAL: OCR SINGLE IMAGE
+# INTERNAL: OCR SINGLE IMAGE (OR WHOLE PDF)
 # ============================================================
 def _ocr_image(image_path: str) -> dict:
-    headers = {"Authorization": f"Bearer {MISTRAL_API_KEY}"}
+    started = time.monotonic()
+
+    # Shrink / auto-rotate photos before upload (no-op for PDFs)
+    ocr_path = preprocess_image(image_path)
+    try:
+        result = _ocr_request(ocr_path)
+    finally:
+        if ocr_path != image_path:
+            os.remove(ocr_path)
 
-    if image_path.lower().endswith((".jpg", ".jpeg")):
-        mime = "image/jpeg"
-    elif image_path.lower().endswith(".png"):
-        mime = "image/png"
+    metrics.observe("ocr.image", time.monotonic() - started)
+    return result
+
+
+def _mime_for(path: str) -> str:
+    if path.lower().endswith((".jpg", ".jpeg")):
+        return "image/jpeg"
+    if path.lower().endswith(".png"):
+        return "image/png"
+    if path.lower().endswith(".pdf"):
+        return "application/pdf"
+    return "application/octet-stream"
+
+
+def _ocr_request(image_path: str) -> dict:
+    mime = _mime_for(image_path)
+    file_id = None
+
+    # Small files go inline (one request); larger ones are uploaded first
+    if os.path.getsize(image_path) <= OCR_INLINE_MAX_BYTES:
+        document = _inline_document(image_path, mime)
+        metrics.incr("ocr.inline_requests")
     else:
-        mime = "application/octet-stream"
+        file_id = _upload_file(image_path, mime)
+        document = {"file_id": file_id}
+        metrics.incr("ocr.upload_requests")
+
+    try:
+        return _process_document(document)
+    finally:
+        if file_id:
+            _cleanup_pool.submit(_delete_file, file_id)
+
+
+def _inline_document(path: str, mime: str) -> dict:
+    with open(path, "rb") as f:
+        data_url = f"data:{mime};base64,{base64.b64encode(f.read()).decode()}"
 
-    with open(image_path, "rb") as f:
-        files = {"file": (os.path.basename(image_path), f, mime)}
+    if mime == "application/pdf":
+        return {"type": "document_url", "document_url": data_url}
+    return {"type": "image_url", "image_url": data_url}
+
+
+def _upload_file(path: str, mime: str) -> str:
+    headers = {"Authorization": f"Bearer {MISTRAL_API_KEY}"}
+
+    with open(path, "rb") as f:
+        files = {"file": (os.path.basename(path), f, mime)}
         data = {"purpose": "ocr"}
 
-        upload_res = requests.post(
+        mistral_limiter.acquire()
+        upload_res = mistral_http.post(
             OCR_UPLOAD_URL, headers=headers, files=files, data=data
         )
         upload_res.raise_for_status()
 
     file_id = upload_res.json()["id"]
     print("📤 Uploaded to Mistral OCR → File ID:", file_id)
+    return file_id
+
 
+def _process_document(document: dict) -> dict:
+    headers = {"Authorization": f"Bearer {MISTRAL_API_KEY}"}
     payload = {
         "model": "mistral-ocr-latest",
-        "document": {"file_id": file_id},
+        "document": document,
     }
 
-    ocr_res = requests.post(
+    mistral_limiter.acquire()
+    ocr_res = mistral_http.post(
         OCR_PROCESS_URL, headers=headers, json=payload
     )
     ocr_res.raise_for_status()
@@ -67,14 +162,28 @@ def _ocr_image(image_path: str) -> dict:
     }
 
 
+def _delete_file(file_id: str):
+    # Background: uploaded OCR inputs are not needed once processed
+    try:
+        mistral_limiter.acquire()
+        res = mistral_http.delete(
+            f"{OCR_UPLOAD_URL}/{file_id}",
+            headers={"Authorization": f"Bearer {MISTRAL_API_KEY}"},
+        )
+        res.raise_for_status()
+        metrics.incr("ocr.files_deleted")
+    except Exception as e:
+        print(f"⚠️ Failed to delete Mistral file {file_id}:", e)
+
+
 # ============================================================
 # INTERNAL: STRUCTURED EXTRACTION (RESTORED LLM STEP)
 # ============================================================
-def _extract_structured_data(raw_text: str, expense_mapping: dict) -> dict:
-    if not raw_text.strip():
-        return {}
-
-    prompt = get_ocr_prompt(expense_mapping) + "\n\nText:\n" + raw_text
+def _chat_json(prompt: str, timeout: int = 30):
+    """
+    One extraction chat call. Returns the parsed JSON, or None if the
+    model did not return valid JSON.
+    """
     headers = {
         "Authorization": f"Bearer {MISTRAL_API_KEY}",
         "Content-Type": "application/json",
@@ -86,91 +195,295 @@ def _extract_structured_data(raw_text: str, expense_mapping: dict) -> dict:
             {"role": "user", "content": prompt}
         ],
         "temperature": 0,
+        "response_format": {"type": "json_object"},
     }
 
-    res = requests.post(
+    mistral_limiter.acquire()
+    started = time.monotonic()
+    res = mistral_http.post(
         CHAT_COMPLETIONS_URL,
         headers=headers,
         json=payload,
-        timeout=30,
+        timeout=timeout,
     )
     res.raise_for_status()
+    metrics.observe("llm.chat", time.monotonic() - started)
 
-    content = res.json()["choices"][0]["message"]["content"].strip()
+    body = res.json()
+    usage = body.get("usage") or {}
+    metrics.incr("llm.chat_calls")
+    metrics.incr("llm.prompt_tokens", usage.get("prompt_tokens", 0))
+    metrics.incr("llm.completion_tokens", usage.get("completion_tokens", 0))
 
-    print("🧠 RAW LLM OUTPUT:", content)
+    content = body["choices"][0]["message"]["content"].strip()
 
-    # Strip ```json fences if present
-    if content.startswith("```"):
-        content = "\n".join(
-            line for line in content.splitlines()
-            if not line.strip().startswith("```")
-        )
+    print("🧠 RAW LLM OUTPUT:", content)
 
     try:
-        structured = json.loads(content)
-        print("🧠 STRUCTURED OCR:", structured)
-        return structured
+        return json.loads(content)
     except Exception as e:
         print("❌ Failed to parse structured JSON:", e)
+        return None
+
+
+def _extract_structured_data(raw_text: str, expense_mapping: dict, prompt_version: str = None) -> dict:
+    if not raw_text.strip():
+        return {}
+
+    prompt = get_ocr_prompt(expense_mapping, prompt_version) + "\n\nText:\n" + raw_text
+    structured, invalid = validate_extraction(_chat_json(prompt), expense_mapping)
+
+    if structured is None:
         return {}
 
+    if invalid:
+        structured = _repair_extraction(raw_text, expense_mapping, structured, invalid, prompt_version)
+
+    print("🧠 STRUCTURED OCR:", structured)
+    return structured
+
+
+def _repair_extraction(
+    raw_text: str,
+    expense_mapping: dict,
+    extracted: dict,
+    invalid_fields: list,
+    prompt_version: str = None,
+) -> dict:
+    """
+    Asks again for the invalid fields only and merges them into the
+    extraction. If the repair is still invalid the original values are
+    kept (commit_claim reports the bad mapping to the user).
+    """
+    metrics.incr("ocr.extraction.repairs")
+    print(f"🔧 Repairing extraction fields: {invalid_fields}")
+
+    try:
+        patch = _chat_json(
+            get_repair_prompt(expense_mapping, raw_text, extracted, invalid_fields, prompt_version)
+        )
+    except requests.RequestException as e:
+        print("⚠️ Repair call failed:", e)
+        patch = None
+
+    if isinstance(patch, dict):
+        merged = {**extracted, **{f: patch[f] for f in invalid_fields if f in patch}}
+        repaired, still_invalid = validate_extraction(merged, expense_mapping)
+        if repaired is not None and not still_invalid:
+            metrics.incr("ocr.extraction.repaired")
+            return repaired
+
+    metrics.incr("ocr.extraction.invalid")
+    return extracted
+
+
+def _extract_structured_batch(
+    raw_texts: list[str],
+    expense_mapping: dict,
+    prompt_version: str = None,
+) -> list[dict]:
+    """
+    Extracts several invoices with one chat call. Items with invalid
+    fields get a targeted repair; items that come back missing are
+    retried one by one.
+    """
+    results = [None] * len(raw_texts)
+
+    if len(raw_texts) > 1:
+        metrics.incr("ocr.extraction.batch_calls")
+        try:
+            parsed = _chat_json(
+                get_batch_ocr_prompt(expense_mapping, raw_texts, prompt_version),
+                timeout=30 + 15 * len(raw_texts),
+            )
+        except requests.RequestException as e:
+            print("⚠️ Batch extraction failed, retrying per invoice:", e)
+            parsed = None
+
+        items = parsed.get("invoices") if isinstance(parsed, dict) else None
+        if isinstance(items, list) and len(items) == len(raw_texts):
+            for idx, item in enumerate(items):
+                data, invalid = validate_extraction(item, expense_mapping)
+                if data is not None and invalid:
+                    data = _repair_extraction(
+                        raw_texts[idx], expense_mapping, data, invalid, prompt_version
+                    )
+                results[idx] = data
+
+    for idx, item in enumerate(results):
+        if item is None:
+            if len(raw_texts) > 1:
+                metrics.incr("ocr.extraction.batch_retries")
+            results[idx] = _extract_structured_data(raw_texts[idx], expense_mapping, prompt_version)
+
+    return results
+
 
 # ============================================================
-# INTERNAL: PDF → IMAGE CONVERSION
+# INTERNAL: PDF FALLBACK (RASTERIZE ONE PAGE AT A TIME)
 # ============================================================
-def _convert_pdf_to_images(pdf_path: str) -> list[str]:
-    tmp_dir = tempfile.mkdtemp(prefix="pdf_pages_")
-    pages = convert_from_path(pdf_path, dpi=300)
+def _ocr_pdf_page(pdf_path: str, page_no: int, tmp_dir: str) -> str:
+    started = time.monotonic()
+
+    # Only this page's bitmap is rendered, written straight to tmp_dir
+    page_paths = convert_from_path(
+        pdf_path,
+        dpi=PDF_RASTER_DPI,
+        first_page=page_no,
+        last_page=page_no,
+        output_folder=tmp_dir,
+        fmt="png",
+        paths_only=True,
+    )
+    try:
+        result = _ocr_image(page_paths[0])
+    finally:
+        for p in page_paths:
+            os.remove(p)
+
+    elapsed = time.monotonic() - started
+    metrics.observe("ocr.page", elapsed)
+    print(f"⏱️ OCR page {page_no}: {elapsed:.2f}s")
+    return result.get("raw_text", "")
 
-    image_paths = []
-    for idx, page in enumerate(pages):
-        image_path = os.path.join(tmp_dir, f"page_{idx+1}.png")
-        page.save(image_path, "PNG")
-        image_paths.append(image_path)
 
-    print(f"📄 PDF converted to {len(image_paths)} image(s)")
-    return image_paths
+def _ocr_pdf_rasterized(pdf_path: str) -> str:
+    page_count = pdfinfo_from_path(pdf_path)["Pages"]
+    print(f"📄 Rasterizing PDF: {page_count} page(s)")
+
+    with tempfile.TemporaryDirectory(prefix="pdf_pages_") as tmp_dir:
+        # map() keeps page order when reassembling the text
+        texts = list(_page_pool.map(
+            lambda n: _ocr_pdf_page(pdf_path, n, tmp_dir),
+            range(1, page_count + 1),
+        ))
+
+    return "\n\n".join(t for t in texts if t)
 
 
 # ============================================================
-# PUBLIC: RUN INVOICE OCR (FINAL)
+# INTERNAL: OCR A FILE (PDF OR IMAGE) → RAW TEXT
 # ============================================================
-def run_invoice_ocr(file_path: str, expense_mapping: dict) -> dict:
-    """
-    Returns:
-    { 
-        raw_text: str,
-        structured: dict,
-        model: str
-    }
-    """
-
+def _ocr_file(file_path: str) -> str:
     # -------- PDF FLOW --------
     if file_path.lower().endswith(".pdf"):
         print("📄 Detected PDF invoice")
-        image_paths = _convert_pdf_to_images(file_path)
 
-        combined_text = []
-        for img in image_paths:
-            result = _ocr_image(img)
-            if result.get("raw_text"):
-                combined_text.append(result["raw_text"])
+        if PDF_OCR_MODE == "document":
+            # Mistral OCR reads PDFs natively: one upload, all pages
+            try:
+                started = time.monotonic()
+                result = _ocr_image(file_path)
+                metrics.observe("ocr.pdf_document", time.monotonic() - started)
+                return result.get("raw_text", "")
+            except requests.RequestException as e:
+                print("⚠️ PDF document OCR failed, rasterizing instead:", e)
+                metrics.incr("ocr.pdf_raster_fallbacks")
 
-        raw_text = "\n\n".join(combined_text)
+        return _ocr_pdf_rasterized(file_path)
 
     # -------- IMAGE FLOW --------
+    result = _ocr_image(file_path)
+    return result.get("raw_text", "")
+
+
+# ============================================================
+# INTERNAL: RAW TEXT FOR ONE FILE (CACHED)
+# ============================================================
+def _raw_text_for(file_path: str, sha: str = None) -> tuple[str, str]:
+    # Raw text is keyed by file hash only; structured output also
+    # depends on the tenant mapping and extraction version.
+    sha = sha or ocr_cache.file_sha256(file_path)
+    raw_text = ocr_cache.get_raw(sha)
+
+    if raw_text is None:
+        started = time.monotonic()
+        raw_text = _ocr_file(file_path)
+        metrics.observe("ocr.file", time.monotonic() - started)
+        ocr_cache.put_raw(sha, raw_text)
     else:
-        result = _ocr_image(file_path)
-        raw_text = result.get("raw_text", "")
+        print("♻️ OCR cache hit:", sha[:12])
 
-    structured = _extract_structured_data(raw_text, expense_mapping)
+    return sha, raw_text
 
-    if not structured:
-        print("⚠️ OCR EMPTY — USING FALLBACK VALUES")
 
-    return {
-        "raw_text": raw_text,
-        "structured": structured,
-        "model": "mistral-ocr-latest + mistral-large-latest",
+# ============================================================
+# PUBLIC: RUN INVOICE OCR (FINAL)
+# ============================================================
+def run_invoice_ocr(file_path: str, expense_mapping: dict) -> dict:
+    """
+    Returns:
+    { 
+        raw_text: str,
+        structured: dict,
+        model: str,
+        sha256: str
     }
+    """
+    return run_invoice_ocr_batch([file_path], expense_mapping)[0]
+
+
+# ============================================================
+# PUBLIC: RUN OCR FOR SEVERAL FILES (PARALLEL, ORDER KEPT)
+# ============================================================
+def run_invoice_ocr_batch(
+    file_paths: list[str],
+    expense_mapping: dict,
+    sha256s: list[str] = None,
+) -> list[dict]:
+    """
+    Same as run_invoice_ocr for each file. sha256s, when the caller
+    already hashed the files (e.g. while downloading), saves re-reading
+    them for the cache key. OCR runs concurrently
+    (OCR_PARALLELISM); invoices from known merchants skip the LLM
+    (ocr/rules.py), and structured extraction for the remaining cache
+    misses is batched EXTRACTION_BATCH_SIZE invoices per chat call.
+    Results are returned in input order.
+    """
+    # -------- OCR (CONTENT-ADDRESSED CACHE) --------
+    ocr = list(_file_pool.map(_raw_text_for, file_paths, sha256s or [None] * len(file_paths)))
+
+    fingerprint = ocr_cache.mapping_fingerprint(expense_mapping, EXTRACTION_VERSION)
+    prompt_version = mapping_version(expense_mapping)
+    # Known merchants are parsed locally; the cache covers the rest
+    structured = [
+        extract_with_rules(raw_text, expense_mapping)
+        or ocr_cache.get_structured(sha, fingerprint)
+        for sha, raw_text in ocr
+    ]
+
+    # -------- BATCHED EXTRACTION FOR MISSES --------
+    pending = [
+        idx for idx, item in enumerate(structured)
+        if item is None and ocr[idx][1].strip()
+    ]
+    chunks = [
+        pending[i:i + EXTRACTION_BATCH_SIZE]
+        for i in range(0, len(pending), EXTRACTION_BATCH_SIZE)
+    ]
+    extracted = _file_pool.map(
+        lambda chunk: _extract_structured_batch(
+            [ocr[i][1] for i in chunk], expense_mapping, prompt_version
+        ),
+        chunks,
+    )
+
+    for chunk, items in zip(chunks, extracted):
+        for idx, item in zip(chunk, items):
+            structured[idx] = item
+            if is_valid_extraction(item, expense_mapping):
+                ocr_cache.put_structured(ocr[idx][0], fingerprint, item)
+
+    results = []
+    for (sha, raw_text), item in zip(ocr, structured):
+        if not item:
+            print("⚠️ OCR EMPTY — USING FALLBACK VALUES")
+
+        results.append({
+            "raw_text": raw_text,
+            "structured": item or {},
+            "model": "mistral-ocr-latest + mistral-large-latest",
+            "sha256": sha,
+        })
+
+    return results
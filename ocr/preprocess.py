@@ -0,0 +1,89 @@
+# ocr/preprocess.py
+
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+from utils import metrics
+
+load_dotenv()
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1") == "1"
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "2000"))   # px, longest side
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "85"))
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "1") == "1"
+OCR_PREPROCESS_WORKERS = int(os.getenv("OCR_PREPROCESS_WORKERS", "2"))
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the web process is multi-threaded
+        _pool = ProcessPoolExecutor(
+            max_workers=OCR_PREPROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+# --------------------------------------------------
+# WORKER (runs in a child process)
+# --------------------------------------------------
+def _shrink(src: str, dst: str, max_dim: int, quality: int, grayscale: bool) -> Tuple[int, int]:
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im)   # phone photos are often rotated via EXIF
+        im.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
+        im = im.convert("L" if grayscale else "RGB")
+        im.save(dst, "JPEG", quality=quality, optimize=True)
+
+    return os.path.getsize(src), os.path.getsize(dst)
+
+
+# --------------------------------------------------
+# PUBLIC
+# --------------------------------------------------
+def preprocess_image(image_path: str) -> str:
+    """
+    Returns the path of a smaller, upright JPEG for OCR, or the original
+    path when preprocessing is off, fails or does not shrink the file.
+    The caller removes the returned file if it differs from the input.
+    """
+    if not OCR_PREPROCESS or not image_path.lower().endswith(IMAGE_SUFFIXES):
+        return image_path
+
+    src = Path(image_path)
+    dst = src.with_name(f"{src.stem}.ocr.jpg")
+    started = time.monotonic()
+
+    try:
+        before, after = _get_pool().submit(
+            _shrink, str(src), str(dst), OCR_MAX_DIMENSION, OCR_JPEG_QUALITY, OCR_GRAYSCALE
+        ).result()
+    except Exception as e:
+        print("⚠️ Image preprocessing failed, using original:", e)
+        dst.unlink(missing_ok=True)
+        return image_path
+
+    metrics.observe("ocr.preprocess", time.monotonic() - started)
+
+    if after >= before:
+        dst.unlink(missing_ok=True)
+        return image_path
+
+    metrics.incr("ocr.preprocess.bytes_in", before)
+    metrics.incr("ocr.preprocess.bytes_saved", before - after)
+    print(f"🗜️ Preprocessed {src.name}: {before} → {after} bytes")
+    return str(dst)
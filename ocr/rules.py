@@ -0,0 +1,288 @@
+# ocr/rules.py
+
+import os
+import re
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from utils import metrics
+from ocr.schema import validate_extraction
+
+load_dotenv()
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+# Off until the fixture corpus (tests/fixtures/receipts) shows the
+# rules are accurate enough to skip the LLM in production
+OCR_RULES = os.getenv("OCR_RULES", "0") == "1"
+OCR_RULES_FILE = Path(os.getenv(
+    "OCR_RULES_FILE", str(Path(__file__).resolve().parent / "merchant_rules.json")
+))
+
+GSTIN_RE = re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]\b")
+
+_NUMBER = r"([\d,]+(?:\.\d{1,2})?)"
+_CURRENCY = r"(?:rs\.?|inr|₹)?"
+
+TOTAL_RE = re.compile(
+    r"(?<![A-Za-z])(grand\s*total|net\s*(?:amount|payable|total)|total\s*(?:amount|payable)"
+    r"|amount\s*payable|total)"
+    rf"\s*(?:\({_CURRENCY}\))?\s*[:\-]?\s*{_CURRENCY}\s*{_NUMBER}",
+    re.IGNORECASE,
+)
+SUBTOTAL_RE = re.compile(r"sub[\s\-]*$", re.IGNORECASE)
+# Lower wins: a labelled grand / net total beats a plain "total" line
+TOTAL_RANKS = (
+    (re.compile(r"grand", re.IGNORECASE), 0),
+    (re.compile(r"net", re.IGNORECASE), 1),
+    (re.compile(r"payable|amount", re.IGNORECASE), 2),
+)
+TAX_RE = re.compile(
+    r"\b(CGST|SGST|UTGST|IGST)\b\s*(?:@\s*)?(?:[\d.]+\s*%)?\s*[:\-]?\s*"
+    rf"{_CURRENCY}\s*([\d,]+\.\d{{1,2}})",
+    re.IGNORECASE,
+)
+INVOICE_NO_RE = re.compile(
+    r"(?:invoice|inv|bill|receipt|txn|transaction)\s*(?:no|number|num|#|id)\.?\s*[:\-#]?\s*"
+    r"([A-Z0-9][A-Z0-9/\-]{2,})",
+    re.IGNORECASE,
+)
+DATE_PATTERNS = (
+    (re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b"), lambda m: f"{m[1]}-{m[2]}-{m[3]}", "%Y-%m-%d"),
+    (re.compile(r"\b(\d{1,2})[/\-.](\d{1,2})[/\-.](\d{4})\b"), lambda m: f"{m[1]}/{m[2]}/{m[3]}", "%d/%m/%Y"),
+    (re.compile(r"\b(\d{1,2})[/\-.](\d{1,2})[/\-.](\d{2})\b"), lambda m: f"{m[1]}/{m[2]}/{m[3]}", "%d/%m/%y"),
+    (re.compile(r"\b(\d{1,2})[\s\-]([A-Za-z]{3})[A-Za-z]*[\s\-,]+(\d{4})\b"), lambda m: f"{m[1]} {m[2]} {m[3]}", "%d %b %Y"),
+)
+DATE_LABEL_RE = re.compile(r"\b(?:date|dated)\b", re.IGNORECASE)
+NOT_BILL_DATE_RE = re.compile(r"\b(?:due|expiry|check|arrival|departure)\b", re.IGNORECASE)
+CHECK_IN_RE = re.compile(r"\b(?:check[\s\-]*in|arrival)\b", re.IGNORECASE)
+CHECK_OUT_RE = re.compile(r"\b(?:check[\s\-]*out|departure)\b", re.IGNORECASE)
+LABEL_WINDOW = 60   # chars after a check-in / check-out label searched for its date
+
+
+# --------------------------------------------------
+# MERCHANT SIGNATURE INDEX
+# --------------------------------------------------
+def _load_rules(path: Path) -> list:
+    if not OCR_RULES:
+        return []
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError) as e:
+        print("⚠️ Merchant rules not loaded:", e)
+        return []
+
+
+def _squash(text: str) -> str:
+    return " ".join(text.upper().split())
+
+
+_rules = _load_rules(OCR_RULES_FILE)
+_by_name = {_squash(name): rule for rule in _rules for name in rule.get("names", [])}
+_by_gstin = {gstin.upper(): rule for rule in _rules for gstin in rule.get("gstins", [])}
+
+# One alternation over every known name, longest first so "UBER INDIA"
+# wins over "UBER"; whitespace is matched loosely because of OCR.
+_name_re = re.compile(
+    r"\b(?:" + "|".join(
+        r"\s+".join(re.escape(part) for part in name.split())
+        for name in sorted(_by_name, key=len, reverse=True)
+    ) + r")\b",
+    re.IGNORECASE,
+) if _by_name else None
+
+
+def _match_merchant(raw_text: str) -> Optional[dict]:
+    """
+    A GSTIN match wins; otherwise every matched name must point to the
+    same merchant.
+    """
+    for gstin in GSTIN_RE.findall(raw_text.upper()):
+        if gstin in _by_gstin:
+            return _by_gstin[gstin]
+
+    if _name_re is None:
+        return None
+
+    matched = {id(_by_name[_squash(m)]): _by_name[_squash(m)] for m in _name_re.findall(raw_text)}
+    return next(iter(matched.values())) if len(matched) == 1 else None
+
+
+def _resolve_category(rule: dict, expense_mapping: dict) -> Optional[tuple]:
+    """
+    Rules name sub-types, not tenant-specific types: the first rule
+    sub-type that occurs exactly once in the mapping decides both.
+    """
+    for wanted in rule.get("sub_types", []):
+        hits = [
+            (expense_type, sub_type)
+            for expense_type, sub_types in expense_mapping.items()
+            for sub_type in sub_types
+            if sub_type.lower() == wanted.lower()
+        ]
+        if len(hits) == 1:
+            return hits[0]
+        if hits:
+            return None
+    return None
+
+
+# --------------------------------------------------
+# FIELD PARSERS
+# --------------------------------------------------
+def _to_number(text: str) -> Optional[float]:
+    try:
+        return float(text.replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _total_rank(label: str) -> int:
+    return next((rank for pattern, rank in TOTAL_RANKS if pattern.search(label)), 3)
+
+
+def parse_amount(raw_text: str) -> Optional[str]:
+    """
+    The best-labelled total (grand > net > payable / amount > total);
+    the last one wins among equals. Subtotals are never the amount.
+    """
+    best = None
+    for m in TOTAL_RE.finditer(raw_text):
+        value = _to_number(m.group(2))
+        if not value or SUBTOTAL_RE.search(raw_text[max(0, m.start() - 5):m.start()]):
+            continue
+        rank = _total_rank(m.group(1))
+        if best is None or rank <= best[0]:
+            best = (rank, value)
+    return f"{best[1]:.2f}" if best else None
+
+
+def parse_tax(raw_text: str) -> str:
+    taxes = {}
+    for kind, value in TAX_RE.findall(raw_text):
+        taxes.setdefault(kind.upper(), _to_number(value) or 0.0)
+    return f"{sum(taxes.values()):.2f}" if taxes else ""
+
+
+def _find_dates(text: str) -> list:
+    """
+    Every date in text as (start, "YYYY-MM-DD"), in reading order;
+    where two patterns overlap the longer reading is kept.
+    """
+    found = []
+    for pattern, render, fmt in DATE_PATTERNS:
+        for m in pattern.finditer(text):
+            try:
+                iso = datetime.strptime(render(m), fmt).strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+            found.append((m.start(), -m.end(), iso))
+
+    dates, last_end = [], -1
+    for start, neg_end, iso in sorted(found):
+        if start >= last_end:
+            dates.append((start, iso))
+            last_end = -neg_end
+    return dates
+
+
+def parse_date(raw_text: str) -> Optional[str]:
+    """
+    The first date labelled as the bill date ("Date:", "Bill Date" ...),
+    otherwise the first date in the text.
+    """
+    dates = _find_dates(raw_text)
+    for start, iso in dates:
+        line = raw_text[raw_text.rfind("\n", 0, start) + 1:start]
+        if DATE_LABEL_RE.search(line) and not NOT_BILL_DATE_RE.search(line):
+            return iso
+    return dates[0][1] if dates else None
+
+
+def _date_after(raw_text: str, label_re, skip: int = -1) -> Optional[tuple]:
+    for m in label_re.finditer(raw_text):
+        for start, iso in _find_dates(raw_text[m.end():m.end() + LABEL_WINDOW]):
+            if m.end() + start != skip:
+                return m.end() + start, iso
+    return None
+
+
+def parse_stay(raw_text: str) -> Optional[tuple]:
+    """
+    (check_in, check_out) for hotel bills, or None unless both are found
+    and in order. In "Arrival  Departure / 01/01/2025  03/01/2025" tables
+    the check-out label sees the check-in date first, so that one is
+    skipped.
+    """
+    check_in = _date_after(raw_text, CHECK_IN_RE)
+    check_out = _date_after(raw_text, CHECK_OUT_RE, skip=check_in[0]) if check_in else None
+    if not check_out or check_out[1] < check_in[1]:
+        return None
+    return check_in[1], check_out[1]
+
+
+def parse_invoice_number(raw_text: str) -> str:
+    m = INVOICE_NO_RE.search(raw_text)
+    return m.group(1) if m else ""
+
+
+# --------------------------------------------------
+# PUBLIC
+# --------------------------------------------------
+def extract_with_rules(raw_text: str, expense_mapping: dict) -> Optional[dict]:
+    """
+    Deterministic extraction for known merchants. Returns a structured
+    dict only when merchant, category, amount and date are all found
+    (for "stay" rules, i.e. hotels: check-in and check-out); None means
+    "ask the LLM".
+    """
+    if not _rules or not raw_text.strip():
+        return None
+
+    rule = _match_merchant(raw_text)
+    category = _resolve_category(rule, expense_mapping) if rule else None
+    amount = parse_amount(raw_text) if category else None
+    if not amount:
+        dates = None
+    elif rule.get("stay"):
+        dates = parse_stay(raw_text)
+    else:
+        date = parse_date(raw_text)
+        dates = (date, date) if date else None
+
+    if not dates:
+        metrics.incr("ocr.rules.misses")
+        return None
+
+    structured, invalid = validate_extraction({
+        "expense_type": category[0],
+        "expense_sub_type": category[1],
+        "merchant_name": rule["merchant"],
+        "invoice_number": parse_invoice_number(raw_text),
+        "from_date": dates[0],
+        "to_date": dates[1],
+        "amount": amount,
+        "VAT": parse_tax(raw_text),
+    }, expense_mapping)
+
+    if invalid:
+        metrics.incr("ocr.rules.misses")
+        return None
+
+    metrics.incr("ocr.rules.hits")
+    print(f"📏 Rule-based extraction: {rule['merchant']} → {category[0]} / {category[1]}")
+    return structured
+
+
+def _hit_rate() -> float:
+    hits = metrics.get_counter("ocr.rules.hits")
+    total = hits + metrics.get_counter("ocr.rules.misses")
+    return hits / total if total else 0.0
+
+
+metrics.register_gauge("ocr.rules.hit_rate", _hit_rate)
@@ -0,0 +1,83 @@
+# ocr/schema.py
+
+from typing import Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, ValidationError, ValidationInfo, field_validator
+
+# Fields that must agree with the tenant expense mapping
+MAPPING_FIELDS = ("expense_type", "expense_sub_type")
+
+
+# --------------------------------------------------
+# MODEL (core schema is compiled once, at import)
+# --------------------------------------------------
+class InvoiceExtraction(BaseModel):
+    """
+    One invoice as returned by the extraction prompt. The tenant mapping
+    is passed as validation context: {"mapping": {type: [sub_types]}}.
+    """
+
+    model_config = ConfigDict(
+        extra="ignore",
+        str_strip_whitespace=True,
+        coerce_numbers_to_str=True,   # the model sometimes returns 120.5 instead of "120.5"
+    )
+
+    expense_type: str
+    expense_sub_type: str
+    merchant_name: str = ""
+    invoice_number: str = ""
+    from_date: str = ""
+    to_date: str = ""
+    amount: str = ""
+    VAT: str = ""
+
+    @field_validator("expense_type")
+    @classmethod
+    def _type_in_mapping(cls, value: str, info: ValidationInfo) -> str:
+        mapping = (info.context or {}).get("mapping")
+        if mapping is not None and value not in mapping:
+            raise ValueError("expense_type is not in the mapping")
+        return value
+
+    @field_validator("expense_sub_type")
+    @classmethod
+    def _sub_type_in_mapping(cls, value: str, info: ValidationInfo) -> str:
+        mapping = (info.context or {}).get("mapping")
+        expense_type = info.data.get("expense_type")
+        # expense_type failed on its own; both get repaired together
+        if mapping is None or expense_type is None:
+            return value
+        if value not in mapping.get(expense_type, []):
+            raise ValueError("expense_sub_type does not belong to expense_type")
+        return value
+
+
+# --------------------------------------------------
+# VALIDATION
+# --------------------------------------------------
+def validate_extraction(item, expense_mapping: dict) -> Tuple[Optional[dict], list]:
+    """
+    Returns (data, invalid_fields).
+    - valid item:   (normalised dict, [])
+    - invalid item: (item's values, [field, ...]) so only those are repaired
+    - not an object: (None, [])
+    """
+    if not isinstance(item, dict):
+        return None, []
+
+    try:
+        model = InvoiceExtraction.model_validate(item, context={"mapping": expense_mapping})
+    except ValidationError as e:
+        invalid = {str(err["loc"][0]) for err in e.errors() if err["loc"]}
+        if "expense_type" in invalid:
+            invalid.add("expense_sub_type")
+        ordered = [f for f in InvoiceExtraction.model_fields if f in invalid]
+        return dict(item), ordered
+
+    return model.model_dump(), []
+
+
+def is_valid_extraction(item, expense_mapping: dict) -> bool:
+    data, invalid = validate_extraction(item, expense_mapping)
+    return data is not None and not invalid
@@ -1,11 +1,65 @@
 # ocr_prompt.py
 
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from utils import metrics
+
+# ---------------------------------------------------------
+# RENDERED PROMPT CACHE
+# ---------------------------------------------------------
+# The mapping is most of the prompt, so the rendered text is cached per
+# mapping version (a content hash, hence per tenant taxonomy).
+PROMPT_CACHE_SIZE = 128
+
+_rendered: "OrderedDict[str, str]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def encode_mapping(expense_mapping: dict) -> str:
+    # Compact JSON: no indentation / spaces, unicode kept as-is
+    return json.dumps(expense_mapping, separators=(",", ":"), ensure_ascii=False)
+
+
+def mapping_version(expense_mapping: dict) -> str:
+    blob = json.dumps(expense_mapping, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token; good enough for before/after comparison
+    return len(text) // 4 + 1
+
+
 # ---------------------------------------------------------
 # FUNCTION: CREATE OCR PROMPT FOR MISTRAL (STRICT MODE)
 # ---------------------------------------------------------
-import json
+def get_ocr_prompt(expense_mapping: dict, version: Optional[str] = None):
+    version = version or mapping_version(expense_mapping)
+
+    with _lock:
+        prompt = _rendered.get(version)
+        if prompt is not None:
+            _rendered.move_to_end(version)
+            metrics.incr("prompt.cache_hits")
+            return prompt
+
+    prompt = _render_ocr_prompt(encode_mapping(expense_mapping))
+    metrics.incr("prompt.cache_misses")
+    print(f"🧾 OCR prompt rendered for mapping {version}: ~{estimate_tokens(prompt)} tokens")
+
+    with _lock:
+        _rendered[version] = prompt
+        while len(_rendered) > PROMPT_CACHE_SIZE:
+            _rendered.popitem(last=False)
 
-def get_ocr_prompt(expense_mapping: dict):
+    return prompt
+
+
+def _render_ocr_prompt(mapping_text: str):
     return f"""
 You are an automated expense classification engine.
 
@@ -22,8 +76,8 @@ You MUST ALWAYS choose:
 If multiple options seem valid, choose the CLOSEST and MOST REASONABLE match
 based on the invoice content (merchant, description, items, context).
 
-Expense Type → Sub-Type Mapping (SOURCE OF TRUTH):
-{json.dumps(expense_mapping, indent=2)}
+Expense Type → Sub-Type Mapping (SOURCE OF TRUTH, JSON object of type → list of sub-types):
+{mapping_text}
 
 You MUST extract EXACTLY these fields:
 - expense_type
@@ -56,4 +110,56 @@ EXPECTED JSON FORMAT (RETURN EXACTLY THIS STRUCTURE):
   "amount": "",
   "VAT": ""
 }}
-"""
\ No newline at end of file
+"""
+
+
+# ---------------------------------------------------------
+# FUNCTION: BATCH PROMPT (SEVERAL INVOICES, ONE CALL)
+# ---------------------------------------------------------
+def get_batch_ocr_prompt(expense_mapping: dict, raw_texts: list, version: Optional[str] = None):
+    count = len(raw_texts)
+    invoices = "\n\n".join(
+        f"### Invoice {idx}\n{text}"
+        for idx, text in enumerate(raw_texts, start=1)
+    )
+
+    return get_ocr_prompt(expense_mapping, version) + f"""
+BATCH MODE:
+You will receive {count} separate invoices below, each starting with "### Invoice <n>".
+Apply ALL rules above to EACH invoice independently.
+
+Return ONE JSON object of this form:
+{{"invoices": [<object for Invoice 1>, <object for Invoice 2>, ...]}}
+
+The "invoices" array MUST contain EXACTLY {count} objects, in the same order as the invoices.
+
+{invoices}
+"""
+
+
+# ---------------------------------------------------------
+# FUNCTION: REPAIR PROMPT (ONLY THE INVALID FIELDS)
+# ---------------------------------------------------------
+def get_repair_prompt(
+    expense_mapping: dict,
+    raw_text: str,
+    extracted: dict,
+    invalid_fields: list,
+    version: Optional[str] = None,
+):
+    fields = ", ".join(invalid_fields)
+    template = json.dumps({f: "" for f in invalid_fields})
+
+    return get_ocr_prompt(expense_mapping, version) + f"""
+REPAIR MODE:
+A previous extraction of the invoice below returned invalid values for: {fields}
+Previous extraction:
+{json.dumps(extracted, ensure_ascii=False)}
+
+Re-check ONLY these fields against the invoice text and the mapping.
+Return ONE JSON object containing ONLY these fields:
+{template}
+
+Text:
+{raw_text}
+"""
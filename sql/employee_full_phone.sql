@@ -0,0 +1,27 @@
+-- Precomputed, indexable phone key for the WhatsApp profile lookup.
+-- (country_code + phone_number) = ? cannot use an index; full_phone can.
+
+IF COL_LENGTH('product.EmployeeMaster', 'full_phone') IS NULL
+    ALTER TABLE [product].[EmployeeMaster]
+        ADD full_phone AS (country_code + phone_number) PERSISTED;
+GO
+
+IF NOT EXISTS (
+    SELECT 1 FROM sys.indexes
+    WHERE name = 'IX_EmployeeMaster_full_phone'
+      AND object_id = OBJECT_ID('product.EmployeeMaster')
+)
+    CREATE INDEX IX_EmployeeMaster_full_phone
+        ON [product].[EmployeeMaster] (full_phone)
+        INCLUDE (emp_no, tenant_id, is_disabled);
+GO
+
+IF NOT EXISTS (
+    SELECT 1 FROM sys.indexes
+    WHERE name = 'IX_WhatsappUser_phone_number'
+      AND object_id = OBJECT_ID('product.WhatsappUser')
+)
+    CREATE INDEX IX_WhatsappUser_phone_number
+        ON [product].[WhatsappUser] (phone_number)
+        INCLUDE (feature, is_disabled);
+GO
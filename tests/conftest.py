@@ -0,0 +1,20 @@
+# tests/conftest.py
+
+import fakeredis
+import pytest
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    fake_redis(module, ...) points each module's redis_client at one
+    shared in-memory Redis and returns it.
+    """
+    client = fakeredis.FakeRedis(decode_responses=True)
+
+    def patch(*modules):
+        for module in modules:
+            monkeypatch.setattr(module, "redis_client", client)
+        return client
+
+    return patch
@@ -0,0 +1,40 @@
+# tests/test_claim_adapter.py
+
+import os
+
+import pytest
+
+os.environ.setdefault("CLAIMIFY_API_BASE", "http://claimify.test")
+
+from app.services.claim_adapter import match_new_bills  # noqa: E402
+
+
+def test_matches_echoed_invoice_numbers_in_sent_order():
+    response = [
+        {"bill_no": 10, "invoice_number": "OLD-1"},
+        {"bill_no": 12, "invoice_number": "B"},
+        {"bill_no": 11, "invoice_number": "A"},
+    ]
+    sent = [{"invoice_number": "A"}, {"invoice_number": "B"}]
+
+    assert match_new_bills(response, sent) == [11, 12]
+
+
+def test_newest_bill_wins_for_a_repeated_invoice_number():
+    response = [
+        {"bill_no": 4, "invoice_number": "A"},
+        {"bill_no": 9, "invoice_number": "A"},
+    ]
+    assert match_new_bills(response, [{"invoice_number": "A"}]) == [9]
+
+
+def test_falls_back_to_newest_bill_nos_without_invoice_numbers():
+    response = [{"bill_no": 3}, {"bill_no": 7}, {"bill_no": 5}]
+    sent = [{"invoice_number": ""}, {"invoice_number": None}]
+
+    assert match_new_bills(response, sent) == [5, 7]
+
+
+def test_raises_when_response_has_fewer_bills_than_sent():
+    with pytest.raises(Exception, match="files not attached"):
+        match_new_bills([{"bill_no": 3}], [{}, {}])
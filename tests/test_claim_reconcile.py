@@ -0,0 +1,71 @@
+# tests/test_claim_reconcile.py
+
+import pytest
+
+from app.services import claim_reconcile
+
+
+@pytest.fixture
+def client(fake_redis):
+    return fake_redis(claim_reconcile)
+
+
+def test_due_claim_is_handed_over_once(client, monkeypatch):
+    monkeypatch.setattr(claim_reconcile, "CHAT_TTL", -1)   # due immediately
+    claim_reconcile.schedule("919000", 42, 7, "E1", 350.0)
+
+    seen = []
+    claim_reconcile.sweep_once(lambda *args: seen.append(args))
+    claim_reconcile.sweep_once(lambda *args: seen.append(args))
+
+    assert seen == [("919000", 42, 7, "E1", 350.0)]
+    # Still the seed for a new conversation until the header is updated
+    assert claim_reconcile.pending_total("919000", 42) == 350.0
+
+    claim_reconcile.done("919000", 42, 350.0)
+    assert claim_reconcile.pending_total("919000", 42) is None
+
+
+def test_done_keeps_a_newer_total(client, monkeypatch):
+    monkeypatch.setattr(claim_reconcile, "CHAT_TTL", -1)
+    claim_reconcile.schedule("919000", 42, 7, "E1", 100.0)
+    claim_reconcile.sweep_once(lambda *args: None)
+
+    # Another append before the swept reconcile ran
+    claim_reconcile.schedule("919000", 42, 7, "E1", 250.0)
+    claim_reconcile.done("919000", 42, 100.0)
+
+    assert claim_reconcile.pending_total("919000", 42) == 250.0
+    assert client.zcard(claim_reconcile.DUE_KEY) == 1
+
+
+def test_claim_is_not_swept_before_the_conversation_expires(client):
+    claim_reconcile.schedule("919000", 42, 7, "E1", 350.0)
+
+    seen = []
+    claim_reconcile.sweep_once(lambda *args: seen.append(args))
+
+    assert seen == []
+
+
+def test_rescheduling_keeps_the_latest_total(client, monkeypatch):
+    monkeypatch.setattr(claim_reconcile, "CHAT_TTL", -1)
+    claim_reconcile.schedule("919000", 42, 7, "E1", 100.0)
+    claim_reconcile.schedule("919000", 42, 7, "E1", 250.0)
+
+    seen = []
+    claim_reconcile.sweep_once(lambda *args: seen.append(args))
+
+    assert seen == [("919000", 42, 7, "E1", 250.0)]
+
+
+def test_cancel_drops_the_schedule(client, monkeypatch):
+    monkeypatch.setattr(claim_reconcile, "CHAT_TTL", -1)
+    claim_reconcile.schedule("919000", 42, 7, "E1", 100.0)
+    claim_reconcile.cancel("919000", 42)
+
+    seen = []
+    claim_reconcile.sweep_once(lambda *args: seen.append(args))
+
+    assert seen == []
+    assert client.zcard(claim_reconcile.DUE_KEY) == 0
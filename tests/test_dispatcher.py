@@ -0,0 +1,203 @@
+# tests/test_dispatcher.py
+
+import time
+
+import pytest
+
+from utils import dispatcher
+
+
+@pytest.fixture
+def client(fake_redis):
+    return fake_redis(dispatcher)
+
+
+@pytest.fixture
+def memory_backend(monkeypatch):
+    backend = dispatcher.MemoryBackend(limit=100)
+    monkeypatch.setattr(dispatcher, "_backend", backend)
+    yield backend
+    dispatcher.stop(timeout=2)
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+# --------------------------------------------------
+# LANES
+# --------------------------------------------------
+def test_lane_is_stable_for_a_key():
+    lane = dispatcher._lane(dispatcher.STAGE_WEBHOOK, "919119166247")
+    assert lane == dispatcher._lane(dispatcher.STAGE_WEBHOOK, "919119166247")
+    assert lane in dispatcher._queue_names(dispatcher.STAGE_WEBHOOK)
+
+
+def test_unsharded_stage_has_one_queue():
+    assert dispatcher._queue_names(dispatcher.STAGE_OCR) == [dispatcher.STAGE_OCR]
+
+
+def test_unknown_task_is_rejected(memory_backend):
+    with pytest.raises(KeyError):
+        dispatcher.dispatch(dispatcher.STAGE_OCR, "no_such_task")
+
+
+def test_same_key_runs_in_order(memory_backend):
+    seen = []
+
+    @dispatcher.task
+    def _record_in_order(n):
+        time.sleep(0.001)
+        seen.append(n)
+
+    for n in range(20):
+        dispatcher.dispatch(dispatcher.STAGE_WEBHOOK, "_record_in_order", n, key="9190000")
+
+    dispatcher.start()
+    assert _wait_for(lambda: len(seen) == 20)
+    assert seen == list(range(20))
+
+
+class _FlakyAckBackend(dispatcher.MemoryBackend):
+    def __init__(self, limit: int):
+        super().__init__(limit)
+        self.failed_acks = 0
+
+    def ack(self, qname: str, raw: str):
+        if not self.failed_acks:
+            self.failed_acks += 1
+            raise ConnectionError("Redis went away during LREM")
+
+
+def test_lane_worker_survives_ack_errors_and_malformed_jobs(monkeypatch):
+    backend = _FlakyAckBackend(limit=100)
+    monkeypatch.setattr(dispatcher, "_backend", backend)
+    monkeypatch.setattr(dispatcher, "POLL_TIMEOUT", 0.01)
+    seen = []
+
+    @dispatcher.task
+    def _record_survivor(n):
+        seen.append(n)
+
+    lane = dispatcher._lane(dispatcher.STAGE_WEBHOOK, "9190000")
+    dispatcher.dispatch(dispatcher.STAGE_WEBHOOK, "_record_survivor", 1, key="9190000")
+    backend.put(lane, "not json", block=False)
+    dispatcher.dispatch(dispatcher.STAGE_WEBHOOK, "_record_survivor", 2, key="9190000")
+
+    dispatcher.start()
+    try:
+        assert _wait_for(lambda: seen == [1, 2])
+    finally:
+        dispatcher.stop(timeout=2)
+
+
+# --------------------------------------------------
+# BACKPRESSURE
+# --------------------------------------------------
+def test_memory_backend_rejects_when_full():
+    backend = dispatcher.MemoryBackend(limit=1)
+    backend.put(dispatcher.STAGE_OCR, "a", block=False)
+
+    with pytest.raises(dispatcher.QueueFullError):
+        backend.put(dispatcher.STAGE_OCR, "b", block=False)
+
+
+def test_dispatch_non_blocking_raises_queue_full(monkeypatch):
+    monkeypatch.setattr(dispatcher, "_backend", dispatcher.MemoryBackend(limit=1))
+
+    @dispatcher.task
+    def _noop():
+        pass
+
+    dispatcher.dispatch(dispatcher.STAGE_COMMIT, "_noop", block=False)
+    with pytest.raises(dispatcher.QueueFullError):
+        dispatcher.dispatch(dispatcher.STAGE_COMMIT, "_noop", block=False)
+
+
+def test_redis_backend_rejects_when_full(client):
+    backend = dispatcher.RedisBackend(limit=1)
+    backend.put(dispatcher.STAGE_OCR, "a", block=False)
+
+    with pytest.raises(dispatcher.QueueFullError):
+        backend.put(dispatcher.STAGE_OCR, "b", block=False)
+
+
+# --------------------------------------------------
+# LANE LEASES (REDIS)
+# --------------------------------------------------
+def test_only_the_lane_holder_polls_it(client):
+    first = dispatcher.RedisBackend(limit=10)
+    second = dispatcher.RedisBackend(limit=10)
+    lane = dispatcher._lane(dispatcher.STAGE_WEBHOOK, "9190000")
+
+    assert first.get(lane, 0.01) is None        # takes the lease
+    first.put(lane, "msg-1", block=False)
+    first.put(lane, "msg-2", block=False)
+
+    assert second.get(lane, 0.01) is None       # lease held elsewhere
+    assert client.llen(first._pending(lane)) == 2
+    assert first.get(lane, 1) == "msg-1"
+
+
+def test_released_lane_moves_to_another_consumer(client):
+    first = dispatcher.RedisBackend(limit=10)
+    second = dispatcher.RedisBackend(limit=10)
+    lane = dispatcher._lane(dispatcher.STAGE_WEBHOOK, "9190000")
+
+    first.get(lane, 0.01)
+    first.release()
+    second.put(lane, "msg-1", block=False)
+
+    assert second.get(lane, 1) == "msg-1"
+
+
+def test_unsharded_stages_are_shared(client):
+    first = dispatcher.RedisBackend(limit=10)
+    second = dispatcher.RedisBackend(limit=10)
+    first.put(dispatcher.STAGE_OCR, "a", block=False)
+    first.put(dispatcher.STAGE_OCR, "b", block=False)
+
+    assert first.get(dispatcher.STAGE_OCR, 1) == "a"
+    assert second.get(dispatcher.STAGE_OCR, 1) == "b"
+
+
+# --------------------------------------------------
+# RECOVERY
+# --------------------------------------------------
+def test_recover_leaves_live_consumers_alone(client):
+    running = dispatcher.RedisBackend(limit=10)
+    starting = dispatcher.RedisBackend(limit=10)
+
+    running.heartbeat()
+    running.put(dispatcher.STAGE_OCR, "job-1", block=False)
+    assert running.get(dispatcher.STAGE_OCR, 1) == "job-1"
+
+    starting.heartbeat()
+    starting.recover()
+
+    assert client.llen(running._processing(dispatcher.STAGE_OCR)) == 1
+    assert starting.depth(dispatcher.STAGE_OCR) == 0
+
+
+def test_recover_requeues_jobs_of_dead_consumers(client):
+    crashed = dispatcher.RedisBackend(limit=10)
+    starting = dispatcher.RedisBackend(limit=10)
+
+    crashed.heartbeat()
+    crashed.put(dispatcher.STAGE_OCR, "job-1", block=False)
+    assert crashed.get(dispatcher.STAGE_OCR, 1) == "job-1"
+
+    # Heartbeat expired
+    client.delete(crashed._heartbeat_key(crashed.consumer))
+
+    starting.heartbeat()
+    starting.recover()
+
+    assert client.llen(crashed._processing(dispatcher.STAGE_OCR)) == 0
+    assert starting.get(dispatcher.STAGE_OCR, 1) == "job-1"
+    assert crashed.consumer not in client.smembers(dispatcher.RedisBackend.CONSUMERS_KEY)
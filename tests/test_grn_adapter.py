@@ -0,0 +1,103 @@
+# tests/test_grn_adapter.py
+
+import json
+import time
+
+import pytest
+
+from app.services import grn_adapter
+
+
+@pytest.fixture
+def client(fake_redis):
+    return fake_redis(grn_adapter)
+
+
+def _submit(client, job_id, submitted_at=None):
+    client.hset(grn_adapter.JOBS_KEY, job_id, json.dumps({
+        "phone": "919000",
+        "reply_to": f"wamid.{job_id}",
+        "submitted_at": submitted_at or time.time(),
+    }))
+
+
+def test_finished_jobs_go_to_the_completion_callback(client, monkeypatch):
+    statuses = {"a": ({"database_status": "Success"},), "b": None, "c": (None,)}
+    monkeypatch.setattr(grn_adapter, "_poll_job", lambda job_id: statuses[job_id])
+    for job_id in statuses:
+        _submit(client, job_id)
+
+    done = []
+    grn_adapter.poll_once(lambda *args: done.append(args))
+
+    assert sorted(done, key=lambda d: d[1]) == [
+        ("919000", "wamid.a", {"database_status": "Success"}),
+        ("919000", "wamid.c", None),
+    ]
+    assert list(client.hkeys(grn_adapter.JOBS_KEY)) == ["b"]
+
+
+def test_timed_out_job_fails_even_when_polling_errors(client, monkeypatch):
+    def unreachable(job_id):
+        raise ConnectionError("GRN service down")
+
+    monkeypatch.setattr(grn_adapter, "_poll_job", unreachable)
+    _submit(client, "old", submitted_at=time.time() - grn_adapter.GRN_JOB_TIMEOUT - 1)
+
+    done = []
+    grn_adapter.poll_once(lambda *args: done.append(args))
+
+    assert done == [("919000", "wamid.old", None)]
+
+
+def test_job_is_handed_over_once(client, monkeypatch):
+    monkeypatch.setattr(grn_adapter, "_poll_job", lambda job_id: ({"ok": True},))
+    _submit(client, "a")
+
+    done = []
+    grn_adapter.poll_once(lambda *args: done.append(args))
+    grn_adapter.poll_once(lambda *args: done.append(args))
+
+    assert len(done) == 1
+
+
+# --------------------------------------------------
+# JOBS ENDPOINT PROBE
+# --------------------------------------------------
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class _Session:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.posts = 0
+
+    def post(self, *args, **kwargs):
+        self.posts += 1
+        return _Response(self.status_code)
+
+
+def test_missing_jobs_endpoint_is_probed_once(client, monkeypatch, tmp_path):
+    session = _Session(404)
+    monkeypatch.setattr(grn_adapter, "get_session", lambda name: session)
+    grn = tmp_path / "grn.pdf"
+    grn.write_bytes(b"%PDF-1.4")
+
+    assert grn_adapter.submit_grn_job(grn, "919000", "wamid.1") is None
+    assert grn_adapter.submit_grn_job(grn, "919000", "wamid.2") is None
+
+    assert session.posts == 1
+    assert client.ttl(grn_adapter.UNSUPPORTED_KEY) > 0
+
+
+def test_jobs_can_be_disabled(client, monkeypatch, tmp_path):
+    session = _Session(202)
+    monkeypatch.setattr(grn_adapter, "get_session", lambda name: session)
+    monkeypatch.setattr(grn_adapter, "GRN_JOBS_ENABLED", False)
+    grn = tmp_path / "grn.pdf"
+    grn.write_bytes(b"%PDF-1.4")
+
+    assert grn_adapter.submit_grn_job(grn, "919000", "wamid.1") is None
+    assert session.posts == 0
@@ -0,0 +1,32 @@
+# tests/test_http_client.py
+
+import pytest
+
+from utils.http_client import _SafeRetry, RETRY_STATUSES
+
+
+@pytest.fixture
+def retry():
+    return _SafeRetry(total=2, status=2, status_forcelist=RETRY_STATUSES)
+
+
+@pytest.mark.parametrize("status", RETRY_STATUSES)
+def test_idempotent_methods_retry_every_retry_status(retry, status):
+    assert retry.is_retry("GET", status)
+    assert retry.is_retry("PUT", status)
+
+
+@pytest.mark.parametrize("status", [502, 504])
+def test_post_is_not_replayed_after_gateway_errors(retry, status):
+    assert not retry.is_retry("POST", status)
+    assert not retry.is_retry("POST", status, has_retry_after=True)
+
+
+def test_post_retries_rejections_only(retry):
+    assert retry.is_retry("POST", 429)
+    assert retry.is_retry("POST", 503, has_retry_after=True)
+    assert not retry.is_retry("POST", 503)
+
+
+def test_exhausted_retry_does_not_retry_post():
+    assert not _SafeRetry(total=0, status_forcelist=RETRY_STATUSES).is_retry("POST", 429)
@@ -0,0 +1,70 @@
+# tests/test_rules.py
+
+import importlib
+import json
+from pathlib import Path
+
+import pytest
+
+from ocr import rules
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "receipts"
+
+# Corpus mapping: every rule sub-type used by a fixture occurs once
+EXPENSE_MAPPING = {
+    "Travel": ["Fuel", "Cab"],
+    "Lodging": ["Hotel"],
+}
+
+
+@pytest.fixture
+def enabled_rules(monkeypatch):
+    # OCR_RULES is off by default; the merchant index is built at import
+    monkeypatch.setenv("OCR_RULES", "1")
+    yield importlib.reload(rules)
+    monkeypatch.delenv("OCR_RULES")
+    importlib.reload(rules)
+
+
+# --------------------------------------------------
+# CORPUS
+# --------------------------------------------------
+# Each receipts/<name>.txt is OCR output; <name>.json is the expected
+# extraction, or null where the rules must leave it to the LLM.
+@pytest.mark.parametrize("name", sorted(p.stem for p in FIXTURES.glob("*.txt")))
+def test_corpus(enabled_rules, name):
+    raw_text = (FIXTURES / f"{name}.txt").read_text(encoding="utf-8")
+    expected = json.loads((FIXTURES / f"{name}.json").read_text(encoding="utf-8"))
+
+    assert enabled_rules.extract_with_rules(raw_text, EXPENSE_MAPPING) == expected
+
+
+def test_rules_are_off_by_default():
+    assert rules.extract_with_rules("INDIAN OIL\nDate: 14/02/25\nTotal: 500.00", EXPENSE_MAPPING) is None
+
+
+# --------------------------------------------------
+# FIELD PARSERS
+# --------------------------------------------------
+def test_labelled_date_wins_over_earlier_dates():
+    text = "Member since 2017-07-01\nBill Date: 03/01/2025"
+    assert rules.parse_date(text) == "2025-01-03"
+
+
+def test_first_date_by_position_without_label():
+    text = "Ride on 5 Mar 2025\nPrinted 2025-03-09"
+    assert rules.parse_date(text) == "2025-03-05"
+
+
+def test_grand_total_wins_over_larger_subtotal():
+    assert rules.parse_amount("Subtotal: 150.00\nDiscount: 30.00\nTotal 120.00") == "120.00"
+    assert rules.parse_amount("Total 300.00\nNet Payable: Rs. 280.00") == "280.00"
+
+
+def test_stay_from_table_layout():
+    text = "| Arrival    | Departure  |\n| 01/01/2025 | 03/01/2025 |"
+    assert rules.parse_stay(text) == ("2025-01-01", "2025-01-03")
+
+
+def test_stay_needs_both_dates():
+    assert rules.parse_stay("Check-in: 15/03/2025\nTotal: 1,850.00") is None
@@ -0,0 +1,73 @@
+# tests/test_session_store.py
+
+import threading
+
+import pytest
+
+from app import session_store
+from app.constants import STATE_PROCESSING_OCR, STATE_WAITING_FOR_IMAGES
+
+PHONE = "919000"
+
+
+@pytest.fixture
+def client(fake_redis, monkeypatch):
+    client = fake_redis(session_store)
+    # Scripts are bound to the client they were registered on
+    monkeypatch.setattr(
+        session_store, "_ADD_IMAGE", client.register_script(session_store._ADD_IMAGE.script)
+    )
+    return client
+
+
+def _collecting(client, expected: int):
+    client.hset(session_store.session_key(PHONE), mapping={
+        "state": STATE_WAITING_FOR_IMAGES,
+        "expected_images": expected,
+        "received_images": 0,
+    })
+
+
+def test_racing_uploads_hand_the_batch_over_once(client):
+    _collecting(client, expected=3)
+    uploads = 12
+    barrier = threading.Barrier(uploads)
+    results = {}
+
+    def upload(i):
+        barrier.wait()
+        results[f"/tmp/{i}.jpg"] = session_store.add_image(PHONE, f"/tmp/{i}.jpg", f"sha{i}")
+
+    threads = [threading.Thread(target=upload, args=(i,)) for i in range(uploads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    statuses = [status for status, _, _ in results.values()]
+    assert statuses.count(session_store.IMAGE_BATCH_COMPLETE) == 1
+    assert statuses.count(session_store.IMAGE_COLLECTING) == 2
+    assert statuses.count(session_store.IMAGE_REJECTED) == uploads - 3
+
+    # The list is in arrival order: the n-th accepted upload is entry n
+    images = session_store.load(PHONE, images=True)["images"]
+    accepted = {received: path for path, (status, received, _) in results.items()
+                if status != session_store.IMAGE_REJECTED}
+    assert [i["path"] for i in images] == [accepted[n] for n in (1, 2, 3)]
+    assert client.hget(session_store.session_key(PHONE), "state") == STATE_PROCESSING_OCR
+
+
+def test_uploads_after_the_hand_over_are_rejected(client):
+    _collecting(client, expected=2)
+
+    assert session_store.add_image(PHONE, "/tmp/a.jpg", "a") == (session_store.IMAGE_COLLECTING, 1, 2)
+    assert session_store.add_image(PHONE, "/tmp/b.jpg", "b") == (session_store.IMAGE_BATCH_COMPLETE, 2, 2)
+    assert session_store.add_image(PHONE, "/tmp/c.jpg", "c") == (session_store.IMAGE_REJECTED, 0, 0)
+
+    images = session_store.load(PHONE, images=True)["images"]
+    assert images == [{"path": "/tmp/a.jpg", "sha256": "a"}, {"path": "/tmp/b.jpg", "sha256": "b"}]
+
+
+def test_upload_without_a_session_is_rejected(client):
+    assert session_store.add_image(PHONE, "/tmp/a.jpg", "a")[0] == session_store.IMAGE_REJECTED
+    assert client.llen(session_store.images_key(PHONE)) == 0
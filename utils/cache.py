@@ -0,0 +1,85 @@
+# utils/cache.py
+
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+from utils.redis_client import redis_client
+from utils import metrics
+
+
+# --------------------------------------------------
+# TWO-TIER CACHE (in-process LRU → Redis → loader)
+# --------------------------------------------------
+class TwoTierCache:
+    """
+    Values must be JSON-serializable; a loader returning None is not
+    cached. The local tier keeps a short TTL so other processes pick up
+    an invalidation within `local_ttl`.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        *,
+        ttl: int,
+        local_ttl: int = 60,
+        max_entries: int = 256,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.max_entries = max_entries
+
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()  # key → (expires_at, value)
+        self._lock = threading.Lock()
+
+    def _rkey(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+
+        with self._lock:
+            hit = self._local.get(key)
+            if hit and hit[0] > now:
+                self._local.move_to_end(key)
+                metrics.incr(f"cache.{self.namespace}.local_hits")
+                return hit[1]
+
+        value = None
+        try:
+            raw = redis_client.get(self._rkey(key))
+            if raw is not None:
+                value = json.loads(raw)
+                metrics.incr(f"cache.{self.namespace}.redis_hits")
+        except Exception as e:
+            print(f"⚠️ Cache {self.namespace} Redis read failed:", e)
+
+        if value is None:
+            metrics.incr(f"cache.{self.namespace}.misses")
+            value = loader()
+            if value is None:
+                return None
+            try:
+                redis_client.setex(self._rkey(key), self.ttl, json.dumps(value))
+            except Exception as e:
+                print(f"⚠️ Cache {self.namespace} Redis write failed:", e)
+
+        self._store_local(key, value)
+        return value
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._local.pop(key, None)
+        redis_client.delete(self._rkey(key))
+        metrics.incr(f"cache.{self.namespace}.invalidations")
+
+    def _store_local(self, key: str, value: Any):
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.local_ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
@@ -0,0 +1,268 @@
+# utils/db.py
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+import pyodbc
+from dotenv import load_dotenv
+
+from utils import metrics
+
+load_dotenv()
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+DRIVER = os.getenv("DRIVER")
+SQL_SERVER_HOST = os.getenv("SQL_SERVER_HOST")
+SQL_SERVER_PORT = os.getenv("SQL_SERVER_PORT", "1433")
+SQL_SERVER_USER = os.getenv("SQL_SERVER_USER")
+SQL_SERVER_PASSWORD = os.getenv("SQL_SERVER_PASSWORD")
+SQL_SERVER_DB = os.getenv("SQL_SERVER_DB")  # Dev_ExpenseApp
+
+CONN_STR = (
+    f"DRIVER={DRIVER};"
+    f"SERVER={SQL_SERVER_HOST},{SQL_SERVER_PORT};"
+    f"DATABASE={SQL_SERVER_DB};"
+    f"UID={SQL_SERVER_USER};"
+    f"PWD={SQL_SERVER_PASSWORD};"
+    f"TrustServerCertificate=yes;"
+)
+
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_IDLE_TIMEOUT = int(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+DB_POOL_PING_AFTER = int(os.getenv("DB_POOL_PING_AFTER", "30"))  # idle seconds before health check
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+# --------------------------------------------------
+# CONNECTION POOL
+# --------------------------------------------------
+class ConnectionPool:
+    """
+    Thread-safe LIFO pool of DB-API connections.
+
+    `connect` is any zero-arg callable returning a connection, so tests
+    can pass a fake instead of pyodbc.
+    """
+
+    def __init__(
+        self,
+        connect: Callable,
+        max_size: int = DB_POOL_MAX_SIZE,
+        idle_timeout: float = DB_POOL_IDLE_TIMEOUT,
+        acquire_timeout: float = DB_POOL_ACQUIRE_TIMEOUT,
+        ping_after: float = DB_POOL_PING_AFTER,
+    ):
+        self._connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.ping_after = ping_after
+
+        self._idle: List = []   # [(conn, last_used)]
+        self._size = 0          # idle + checked out
+        self._cond = threading.Condition()
+
+    # ---------- acquire / release ----------
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        started = time.monotonic()
+
+        while True:
+            conn, last_used = self._checkout(deadline)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._forget()
+                    raise
+                metrics.incr("db.pool.connects")
+                break
+
+            if time.monotonic() - last_used < self.ping_after or self._ping(conn):
+                metrics.incr("db.pool.reuses")
+                break
+
+            # Stale connection (server closed it) → drop and retry
+            metrics.incr("db.pool.health_failures")
+            self._close(conn)
+            self._forget()
+
+        metrics.observe("db.pool.acquire", time.monotonic() - started)
+        return conn
+
+    def release(self, conn, broken: bool = False):
+        if broken:
+            self._close(conn)
+            self._forget()
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except pyodbc.Error:
+            broken = True
+            raise
+        finally:
+            if not broken:
+                try:
+                    # Ends the implicit read transaction before reuse
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            self.release(conn, broken=broken)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "max": self.max_size}
+
+    # ---------- internals ----------
+    def _checkout(self, deadline: float):
+        """
+        Returns (conn, last_used) from the idle stack, or (None, None)
+        when the caller may open a new connection.
+        """
+        with self._cond:
+            while True:
+                self._evict_idle()
+
+                if self._idle:
+                    return self._idle.pop()
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics.incr("db.pool.timeouts")
+                    raise PoolTimeoutError(
+                        f"No DB connection available within {self.acquire_timeout}s"
+                    )
+                self._cond.wait(remaining)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        keep = []
+        for conn, last_used in self._idle:
+            if now - last_used > self.idle_timeout:
+                self._close(conn)
+                self._size -= 1
+                metrics.incr("db.pool.evictions")
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _ping(conn) -> bool:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# --------------------------------------------------
+# MODULE-LEVEL POOL
+# --------------------------------------------------
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def _odbc_connect():
+    return pyodbc.connect(CONN_STR)
+
+
+def configure(connect: Optional[Callable] = None, **kwargs) -> ConnectionPool:
+    """
+    Replaces the shared pool, e.g. `configure(connect=FakeConnection)`
+    in tests.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool:
+            _pool.close_all()
+        _pool = ConnectionPool(connect or _odbc_connect, **kwargs)
+        return _pool
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(_odbc_connect)
+    return _pool
+
+
+metrics.register_gauge("db.pool.size", lambda: get_pool().stats()["size"])
+metrics.register_gauge("db.pool.idle", lambda: get_pool().stats()["idle"])
+
+
+# --------------------------------------------------
+# QUERY HELPERS
+# --------------------------------------------------
+@contextmanager
+def cursor(name: str = "query"):
+    """
+    Yields a cursor on a pooled connection and records the time spent
+    under `db.query.<name>`.
+    """
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        started = time.monotonic()
+        try:
+            yield cur
+        finally:
+            metrics.observe(f"db.query.{name}", time.monotonic() - started)
+            cur.close()
+
+
+def fetch_all(sql: str, *params, name: str = "query") -> list:
+    with cursor(name) as cur:
+        cur.execute(sql, *params)
+        return cur.fetchall()
+
+
+def fetch_one(sql: str, *params, name: str = "query"):
+    with cursor(name) as cur:
+        cur.execute(sql, *params)
+        return cur.fetchone()
@@ -0,0 +1,75 @@
+# utils/dedup.py
+
+import os
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from utils.redis_client import redis_client
+from utils import metrics
+
+load_dotenv()
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+# Meta retries failed deliveries for up to ~24h
+DEDUP_TTL = int(os.getenv("DEDUP_TTL", str(24 * 3600)))
+DEDUP_LRU_SIZE = int(os.getenv("DEDUP_LRU_SIZE", "10000"))
+
+_lock = threading.Lock()
+_recent: "OrderedDict[str, None]" = OrderedDict()
+
+
+def _dkey(msg_id: str) -> str:
+    return f"wa:dedup:{msg_id}"
+
+
+def _remember(msg_id: str):
+    with _lock:
+        _recent[msg_id] = None
+        _recent.move_to_end(msg_id)
+        while len(_recent) > DEDUP_LRU_SIZE:
+            _recent.popitem(last=False)
+
+
+# --------------------------------------------------
+# PUBLIC
+# --------------------------------------------------
+def is_duplicate(msg_id: str) -> bool:
+    """
+    Marks a WhatsApp message id as seen.
+    Returns True if it was already seen (i.e. a redelivery).
+    """
+    metrics.incr("dedup.checks")
+
+    with _lock:
+        hit = msg_id in _recent
+
+    if not hit:
+        # SET NX is the source of truth across workers/hosts
+        hit = not redis_client.set(_dkey(msg_id), 1, nx=True, ex=DEDUP_TTL)
+        _remember(msg_id)
+
+    if hit:
+        metrics.incr("dedup.hits")
+    return hit
+
+
+def forget(msg_id: str):
+    """
+    Un-marks a message, e.g. when it could not be queued and Meta
+    must be allowed to redeliver it.
+    """
+    with _lock:
+        _recent.pop(msg_id, None)
+    redis_client.delete(_dkey(msg_id))
+
+
+def _hit_rate() -> float:
+    checks = metrics.get_counter("dedup.checks")
+    return metrics.get_counter("dedup.hits") / checks if checks else 0.0
+
+
+metrics.register_gauge("dedup.hit_rate", _hit_rate)
@@ -0,0 +1,433 @@
+# utils/dispatcher.py
+
+import os
+import json
+import time
+import uuid
+import zlib
+import queue
+import socket
+import threading
+from typing import Callable, Dict, List
+
+from dotenv import load_dotenv
+
+from utils.redis_client import redis_client
+from utils import metrics
+
+load_dotenv()
+
+# --------------------------------------------------
+# STAGES
+# --------------------------------------------------
+STAGE_WEBHOOK = "webhook"
+STAGE_OCR = "ocr"
+STAGE_COMMIT = "commit"
+STAGE_GRN = "grn"
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+DISPATCH_BACKEND = os.getenv("DISPATCH_BACKEND", "memory")  # memory | redis
+DISPATCH_QUEUE_LIMIT = int(os.getenv("DISPATCH_QUEUE_LIMIT", "500"))
+
+STAGE_WORKERS = {
+    STAGE_WEBHOOK: int(os.getenv("DISPATCH_WEBHOOK_WORKERS", "8")),
+    STAGE_OCR: int(os.getenv("DISPATCH_OCR_WORKERS", "2")),
+    STAGE_COMMIT: int(os.getenv("DISPATCH_COMMIT_WORKERS", "4")),
+    STAGE_GRN: int(os.getenv("DISPATCH_GRN_WORKERS", "2")),
+}
+
+# Sharded stages give every worker its own queue ("lane"). Jobs with
+# the same key always land on the same lane, so they run strictly in
+# order while different keys still run in parallel.
+SHARDED_STAGES = {STAGE_WEBHOOK}
+
+POLL_TIMEOUT = 1  # seconds a worker waits before re-checking shutdown
+
+# Redis backend: each process heartbeats; processing lists of consumers
+# whose heartbeat expired are handed back to the pending lists.
+HEARTBEAT_INTERVAL = float(os.getenv("DISPATCH_HEARTBEAT_INTERVAL", "10"))
+HEARTBEAT_TTL = int(os.getenv("DISPATCH_HEARTBEAT_TTL", "30"))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+# --------------------------------------------------
+# TASK REGISTRY
+# --------------------------------------------------
+# Jobs are stored by task name (not by callable) so they can be
+# serialized to Redis and replayed after a restart.
+_tasks: Dict[str, Callable] = {}
+
+
+def task(fn: Callable) -> Callable:
+    _tasks[fn.__name__] = fn
+    return fn
+
+
+def _queue_names(stage: str) -> List[str]:
+    if stage in SHARDED_STAGES:
+        return [f"{stage}:{i}" for i in range(STAGE_WORKERS[stage])]
+    return [stage]
+
+
+def _all_queue_names() -> List[str]:
+    return [q for stage in STAGE_WORKERS for q in _queue_names(stage)]
+
+
+def _is_lane(qname: str) -> bool:
+    stage, _, index = qname.partition(":")
+    return stage in SHARDED_STAGES and bool(index)
+
+
+def _lane(stage: str, key: str) -> str:
+    lanes = _queue_names(stage)
+    # crc32 is stable across processes (unlike hash()), which matters
+    # when several hosts share the Redis backend.
+    return lanes[zlib.crc32(key.encode()) % len(lanes)]
+
+
+# --------------------------------------------------
+# BACKENDS
+# --------------------------------------------------
+class MemoryBackend:
+    def __init__(self, limit: int):
+        self._queues = {q: queue.Queue(maxsize=limit) for q in _all_queue_names()}
+
+    def put(self, qname: str, raw: str, block: bool):
+        try:
+            self._queues[qname].put(raw, block=block)
+        except queue.Full:
+            raise QueueFullError(f"{qname} queue is full")
+
+    def get(self, qname: str, timeout: float):
+        try:
+            return self._queues[qname].get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def ack(self, qname: str, raw: str):
+        pass
+
+    def heartbeat(self):
+        pass
+
+    def release(self):
+        pass
+
+    def recover(self):
+        pass
+
+    def depth(self, qname: str) -> int:
+        return self._queues[qname].qsize()
+
+
+class RedisBackend:
+    """
+    Reliable queue: LPUSH → BLMOVE into a per-consumer processing list,
+    LREM on completion. Every process is its own consumer
+    (host:pid:random) and keeps a heartbeat key alive; jobs in the
+    processing lists of consumers whose heartbeat expired are moved back
+    to the pending list, so work survives crashes without live siblings
+    on the same host losing theirs.
+
+    Every process starts a worker per lane, so each lane is leased to
+    one consumer at a time (renewed with the heartbeat); only the holder
+    polls it, which keeps one sender's jobs in order across processes.
+    """
+
+    CONSUMERS_KEY = "jobs:consumers"
+
+    # 2 = newly acquired, 1 = renewed, 0 = held by another consumer
+    _HOLD_LANE = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 2
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+    _RELEASE_LANE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.consumer = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._leases = set()
+        self._hold_lane = redis_client.register_script(self._HOLD_LANE)
+        self._release_lane = redis_client.register_script(self._RELEASE_LANE)
+
+    def _pending(self, qname: str) -> str:
+        return f"jobs:{qname}"
+
+    def _processing(self, qname: str, consumer: str = None) -> str:
+        return f"jobs:{qname}:processing:{consumer or self.consumer}"
+
+    def _heartbeat_key(self, consumer: str) -> str:
+        return f"jobs:consumer:{consumer}:alive"
+
+    def _lease_key(self, qname: str) -> str:
+        return f"jobs:{qname}:owner"
+
+    def _hold(self, qname: str) -> bool:
+        held = self._hold_lane(keys=[self._lease_key(qname)], args=[self.consumer, HEARTBEAT_TTL])
+        if not held:
+            self._leases.discard(qname)
+            return False
+
+        if held == 2:
+            # The previous holder's lease expired with its heartbeat:
+            # hand its in-flight jobs back before taking new ones
+            self.recover()
+        self._leases.add(qname)
+        return True
+
+    def put(self, qname: str, raw: str, block: bool):
+        while redis_client.llen(self._pending(qname)) >= self.limit:
+            if not block:
+                raise QueueFullError(f"{qname} queue is full")
+            time.sleep(0.1)
+        redis_client.lpush(self._pending(qname), raw)
+
+    def get(self, qname: str, timeout: float):
+        if _is_lane(qname) and not self._hold(qname):
+            time.sleep(timeout)
+            return None
+
+        return redis_client.blmove(
+            self._pending(qname),
+            self._processing(qname),
+            timeout,
+            "RIGHT",
+            "LEFT",
+        )
+
+    def ack(self, qname: str, raw: str):
+        redis_client.lrem(self._processing(qname), 1, raw)
+
+    def heartbeat(self):
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.sadd(self.CONSUMERS_KEY, self.consumer)
+        pipe.setex(self._heartbeat_key(self.consumer), HEARTBEAT_TTL, "1")
+        pipe.execute()
+
+        # A long job must not lose its lane while it runs
+        for qname in list(self._leases):
+            self._hold(qname)
+
+    def release(self):
+        for qname in list(self._leases):
+            self._release_lane(keys=[self._lease_key(qname)], args=[self.consumer])
+        self._leases.clear()
+
+    def recover(self):
+        """
+        Requeues the in-flight jobs of dead consumers. Each LMOVE is
+        atomic, so two processes recovering at once never duplicate a job.
+        """
+        for consumer in redis_client.smembers(self.CONSUMERS_KEY):
+            if consumer == self.consumer or redis_client.exists(self._heartbeat_key(consumer)):
+                continue
+
+            for qname in _all_queue_names():
+                moved = 0
+                while redis_client.lmove(
+                    self._processing(qname, consumer), self._pending(qname), "LEFT", "RIGHT"
+                ):
+                    moved += 1
+                if moved:
+                    print(f"♻️ Recovered {moved} {qname} job(s) from dead consumer {consumer}")
+
+            redis_client.srem(self.CONSUMERS_KEY, consumer)
+
+    def depth(self, qname: str) -> int:
+        return redis_client.llen(self._pending(qname))
+
+
+def _make_backend():
+    if DISPATCH_BACKEND == "redis":
+        return RedisBackend(DISPATCH_QUEUE_LIMIT)
+    return MemoryBackend(DISPATCH_QUEUE_LIMIT)
+
+
+_backend = _make_backend()
+_stop = threading.Event()
+_workers: List[threading.Thread] = []
+_heartbeat_thread = None
+_in_flight = {s: 0 for s in STAGE_WORKERS}
+_in_flight_lock = threading.Lock()
+
+for _stage in STAGE_WORKERS:
+    metrics.register_gauge(
+        f"dispatch.{_stage}.queued",
+        lambda s=_stage: sum(_backend.depth(q) for q in _queue_names(s)),
+    )
+    metrics.register_gauge(
+        f"dispatch.{_stage}.in_flight",
+        lambda s=_stage: _in_flight[s],
+    )
+
+
+# --------------------------------------------------
+# PUBLIC API
+# --------------------------------------------------
+def dispatch(stage: str, task_name: str, *args, key: str = "", block: bool = True):
+    """
+    Queues a registered task on a stage.
+    On sharded stages `key` selects the lane (e.g. the sender's phone).
+    With block=False a full queue raises QueueFullError instead of
+    waiting, which lets the webhook push back on Meta.
+    """
+    if task_name not in _tasks:
+        raise KeyError(f"Unknown task: {task_name}")
+
+    raw = json.dumps({
+        "id": uuid.uuid4().hex,
+        "task": task_name,
+        "args": list(args),
+        "enqueued_at": time.time(),
+    })
+
+    qname = _lane(stage, key) if stage in SHARDED_STAGES else stage
+
+    try:
+        _backend.put(qname, raw, block)
+    except QueueFullError:
+        metrics.incr(f"dispatch.{stage}.rejected")
+        raise
+
+    metrics.incr(f"dispatch.{stage}.submitted")
+
+
+def start():
+    if _workers:
+        return
+
+    _stop.clear()
+    _backend.heartbeat()
+    _backend.recover()
+    _start_heartbeat()
+
+    for stage, count in STAGE_WORKERS.items():
+        for i in range(count):
+            t = threading.Thread(
+                target=_worker_loop,
+                args=(stage, _worker_queue(stage, i)),
+                name=f"{stage}-worker-{i}",
+                daemon=True,
+            )
+            t.start()
+            _workers.append(t)
+
+    print(f"🚦 Dispatcher started ({DISPATCH_BACKEND}): {STAGE_WORKERS}")
+
+
+def stop(timeout: float = 5):
+    global _heartbeat_thread
+
+    _stop.set()
+    for t in _workers:
+        t.join(timeout=timeout)
+    _workers.clear()
+
+    # Hand the lanes over now instead of after HEARTBEAT_TTL
+    try:
+        _backend.release()
+    except Exception as e:
+        print("❌ Dispatcher lane release error:", e)
+
+    if _heartbeat_thread is not None:
+        _heartbeat_thread.join(timeout=timeout)
+        _heartbeat_thread = None
+
+
+# --------------------------------------------------
+# HEARTBEAT (REDIS BACKEND)
+# --------------------------------------------------
+def _start_heartbeat():
+    global _heartbeat_thread
+    _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="dispatch-heartbeat", daemon=True)
+    _heartbeat_thread.start()
+
+
+def _heartbeat_loop():
+    # Also recovers consumers that die while this process is running
+    while not _stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            _backend.heartbeat()
+            _backend.recover()
+        except Exception as e:
+            print("❌ Dispatcher heartbeat error:", e)
+
+
+# --------------------------------------------------
+# WORKER
+# --------------------------------------------------
+def _worker_queue(stage: str, index: int) -> str:
+    # One worker per lane on sharded stages; shared queue otherwise
+    return f"{stage}:{index}" if stage in SHARDED_STAGES else stage
+
+
+def _worker_loop(stage: str, qname: str):
+    while not _stop.is_set():
+        try:
+            raw = _backend.get(qname, POLL_TIMEOUT)
+        except Exception as e:
+            print(f"❌ Dispatcher {qname} poll error:", e)
+            time.sleep(POLL_TIMEOUT)
+            continue
+
+        if raw is None:
+            continue
+
+        # A failing ack (or a malformed job) must not kill the thread:
+        # on sharded stages it is the lane's only worker
+        try:
+            _run_job(stage, qname, raw)
+        except Exception as e:
+            print(f"❌ Dispatcher {qname} job error:", e)
+            time.sleep(POLL_TIMEOUT)
+
+
+def _run_job(stage: str, qname: str, raw: str):
+    try:
+        job, started = _job_started(stage, raw)
+    except (ValueError, KeyError, TypeError) as e:
+        metrics.incr(f"dispatch.{stage}.failed")
+        print(f"❌ Malformed job dropped from {qname}:", e)
+        _backend.ack(qname, raw)
+        return
+
+    try:
+        _tasks[job["task"]](*job["args"])
+        metrics.incr(f"dispatch.{stage}.completed")
+    except Exception as e:
+        metrics.incr(f"dispatch.{stage}.failed")
+        print(f"❌ Job {job['task']} failed on {stage}:", e)
+    finally:
+        _job_finished(stage, started)
+        _backend.ack(qname, raw)
+
+
+def _job_started(stage: str, raw: str):
+    job = json.loads(raw)
+    started = time.time()
+    metrics.observe(f"dispatch.{stage}.wait", started - job["enqueued_at"])
+    with _in_flight_lock:
+        _in_flight[stage] += 1
+    return job, started
+
+
+def _job_finished(stage: str, started: float):
+    with _in_flight_lock:
+        _in_flight[stage] -= 1
+    metrics.observe(f"dispatch.{stage}.run", time.time() - started)
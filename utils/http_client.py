@@ -0,0 +1,153 @@
+# utils/http_client.py
+
+import os
+import threading
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+from utils import metrics
+
+load_dotenv()
+
+# --------------------------------------------------
+# UPSTREAMS
+# --------------------------------------------------
+WHATSAPP = "whatsapp"
+MISTRAL = "mistral"
+CLAIMIFY = "claimify"
+GRN = "grn"
+
+# pool_size: keep-alive connections per host
+# timeout:   (connect, read) used when the caller passes none
+# retries:   connect errors + retryable statuses, with backoff (see _SafeRetry)
+_DEFAULTS = {
+    WHATSAPP: {"pool_size": 20, "connect_timeout": 5, "read_timeout": 30, "retries": 3, "backoff": 0.5},
+    MISTRAL: {"pool_size": 10, "connect_timeout": 10, "read_timeout": 120, "retries": 3, "backoff": 1.0},
+    CLAIMIFY: {"pool_size": 10, "connect_timeout": 10, "read_timeout": 60, "retries": 2, "backoff": 0.5},
+    GRN: {"pool_size": 4, "connect_timeout": 10, "read_timeout": 60, "retries": 2, "backoff": 1.0},
+}
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def _config(name: str) -> Dict:
+    cfg = dict(_DEFAULTS[name])
+    for key, default in cfg.items():
+        env = os.getenv(f"HTTP_{name.upper()}_{key.upper()}")
+        if env is not None:
+            cfg[key] = type(default)(env)
+    return cfg
+
+
+# --------------------------------------------------
+# ADAPTER
+# --------------------------------------------------
+class _PooledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies a default timeout when the caller passes none.
+    """
+
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class _SafeRetry(Retry):
+    """
+    Idempotent methods retry on any of RETRY_STATUSES. Other methods
+    (POST) only when the server says it did not process the request:
+    429, or 503 with Retry-After. A 502/504 may arrive after the upstream
+    already applied the POST, and replaying it could duplicate a claim,
+    a GRN job, a WhatsApp message or a Mistral upload.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if self._is_method_retryable(method):
+            return super().is_retry(method, status_code, has_retry_after)
+        return bool(self.total) and (
+            status_code == 429 or (status_code == 503 and has_retry_after)
+        )
+
+
+def _build_session(name: str) -> requests.Session:
+    cfg = _config(name)
+
+    retry = _SafeRetry(
+        total=cfg["retries"],
+        connect=cfg["retries"],  # nothing was sent yet; safe for POST too
+        read=0,  # a read timeout may mean the request was applied; don't replay it
+        status=cfg["retries"],
+        status_forcelist=RETRY_STATUSES,
+        backoff_factor=cfg["backoff"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+    adapter = _PooledAdapter(
+        timeout=(cfg["connect_timeout"], cfg["read_timeout"]),
+        pool_connections=4,
+        pool_maxsize=cfg["pool_size"],
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# --------------------------------------------------
+# PUBLIC
+# --------------------------------------------------
+_sessions: Dict[str, requests.Session] = {}
+_lock = threading.Lock()
+
+
+def get_session(name: str) -> requests.Session:
+    """
+    Returns the shared keep-alive session for an upstream
+    (WHATSAPP, MISTRAL, CLAIMIFY, GRN).
+    """
+    session = _sessions.get(name)
+    if session is None:
+        with _lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = _build_session(name)
+                _sessions[name] = session
+    return session
+
+
+def connection_stats() -> Dict:
+    """
+    Per upstream / host: requests sent, connections opened and how many
+    requests reused an existing connection.
+    """
+    stats = {}
+    for name, session in list(_sessions.items()):
+        hosts = {}
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                h = hosts.setdefault(pool.host, {"requests": 0, "connections": 0})
+                h["requests"] += pool.num_requests
+                h["connections"] += pool.num_connections
+        for h in hosts.values():
+            h["reused"] = max(h["requests"] - h["connections"], 0)
+        stats[name] = hosts
+    return stats
+
+
+metrics.register_gauge("http.connections", connection_stats)
@@ -0,0 +1,73 @@
+# utils/metrics.py
+
+import threading
+from collections import defaultdict
+from typing import Callable, Dict
+
+# --------------------------------------------------
+# IN-PROCESS METRICS (exposed on GET /metrics)
+# --------------------------------------------------
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_timings: Dict[str, Dict[str, float]] = {}
+_gauges: Dict[str, Callable[[], float]] = {}
+
+
+def incr(name: str, value: float = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def get_counter(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def observe(name: str, seconds: float):
+    """
+    Records one timing sample (count / total / max).
+    """
+    with _lock:
+        t = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        t["count"] += 1
+        t["total"] += seconds
+        t["max"] = max(t["max"], seconds)
+
+
+def get_timing(name: str) -> Dict[str, float]:
+    with _lock:
+        return dict(_timings.get(name) or {"count": 0, "total": 0.0, "max": 0.0})
+
+
+def register_gauge(name: str, fn: Callable[[], float]):
+    """
+    Gauges are read lazily when a snapshot is taken.
+    """
+    with _lock:
+        _gauges[name] = fn
+
+
+def snapshot() -> Dict:
+    with _lock:
+        counters = dict(_counters)
+        timings = {
+            name: {
+                **t,
+                "avg": (t["total"] / t["count"]) if t["count"] else 0.0,
+            }
+            for name, t in _timings.items()
+        }
+        gauges = dict(_gauges)
+
+    gauge_values = {}
+    for name, fn in gauges.items():
+        try:
+            gauge_values[name] = fn()
+        except Exception as e:
+            gauge_values[name] = f"error: {e}"
+
+    return {
+        "counters": counters,
+        "gauges": gauge_values,
+        "timings": timings,
+    }
@@ -0,0 +1,81 @@
+# utils/multipart.py
+
+import io
+import uuid
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+class MultipartStream:
+    """
+    multipart/form-data body that reads files from disk while it is
+    being sent, instead of building the whole body in memory the way
+    requests' files= does. Pass it as data= with content_type as the
+    Content-Type header; __len__ gives requests a Content-Length and
+    tell/seek let urllib3 rewind it for a retry.
+    """
+
+    def __init__(self, fields: Dict[str, object], files: List[Tuple[str, Path, str]]):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+        self._parts: List[object] = []   # bytes or Path
+        for name, value in fields.items():
+            self._parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{value}\r\n".encode()
+            )
+        for name, path, mime in files:
+            filename = path.name.replace('"', "%22")
+            self._parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                f'filename="{filename}"\r\nContent-Type: {mime}\r\n\r\n'.encode()
+            )
+            self._parts.append(path)
+            self._parts.append(b"\r\n")
+        self._parts.append(f"--{boundary}--\r\n".encode())
+
+        self._length = sum(
+            len(p) if isinstance(p, bytes) else p.stat().st_size for p in self._parts
+        )
+        self.seek(0)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("MultipartStream can only be rewound")
+        self.close()
+        self._next_part = 0
+        self._pos = 0
+        return 0
+
+    def read(self, size: int = -1) -> bytes:
+        out = bytearray()
+        while size < 0 or len(out) < size:
+            if self._current is None:
+                if self._next_part >= len(self._parts):
+                    break
+                part = self._parts[self._next_part]
+                self._next_part += 1
+                self._current = io.BytesIO(part) if isinstance(part, bytes) else part.open("rb")
+
+            chunk = self._current.read(-1 if size < 0 else size - len(out))
+            if not chunk:
+                self._current.close()
+                self._current = None
+                continue
+            out += chunk
+
+        self._pos += len(out)
+        return bytes(out)
+
+    def close(self):
+        current = getattr(self, "_current", None)
+        if current is not None:
+            current.close()
+        self._current = None
@@ -0,0 +1,40 @@
+# utils/rate_limit.py
+
+import time
+import threading
+
+from utils import metrics
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket: `rate` requests per second on average,
+    bursts of up to `burst` requests.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int = 1):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    if waited:
+                        metrics.observe(f"rate_limit.{self.name}.wait", waited)
+                    return
+
+                sleep_for = (1 - self._tokens) / self.rate
+
+            time.sleep(sleep_for)
+            waited += sleep_for